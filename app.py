@@ -2,41 +2,45 @@
 import os
 import time
 import base64
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import uuid
 import datetime as dt
+from functools import lru_cache
 from typing import Optional, List
 
 from fastapi import FastAPI, HTTPException, Depends, Query, Response, Header, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 
 from pydantic import BaseModel, Field as PydField
+from cachetools import TTLCache
+import orjson
 
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import UniqueConstraint, CheckConstraint, Column, Text, Index, and_, or_
+from sqlalchemy import and_, or_, case, update, delete, bindparam, event
 from sqlalchemy.sql import func
 from sqlalchemy.types import DateTime
 
-from sqlmodel import SQLModel, Field, Session, create_engine, select
-from sqladmin import Admin, ModelView
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection
+from sqlalchemy.orm import joinedload
+from sqlalchemy.engine import Row, make_url
 
-from security import load_keys_from_env, kid_from_pub, sign_token, verify_token
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from security import load_keys_from_env, load_public_key, load_signing_key, kid_from_pub, sign_token, verify_token
 
 # ==== Thời gian: dùng tkt_time (kèm fallback) ====
 import datetime as dt
 from datetime import timezone, timedelta
-try:
-    from zoneinfo import ZoneInfo
-except Exception:
-    ZoneInfo = None
-from utilities.tkt_time import utc_now, utc_now_floor_minute, to_iso_z
-if ZoneInfo:
-    try:
-        LOCAL_TZ = ZoneInfo("Asia/Bangkok")
-    except Exception:
-        LOCAL_TZ = timezone(timedelta(hours=7))
-else:
-    LOCAL_TZ = timezone(timedelta(hours=7))
+from utilities.tkt_time import utc_now, utc_now_floor_minute, to_iso_z, LOCAL_TZ, now_local_naive
+_LOCAL_OFFSET_STR = "+07:00"
 # ============ Download redirect config ============
 GITHUB_OWNER = os.getenv("GITHUB_OWNER", "ISunDevIl")
 GITHUB_REPO  = os.getenv("GITHUB_REPO",  "TKT_Files_Tools")
@@ -50,6 +54,9 @@ def _gh_tag_asset_url(owner: str, repo: str, tag: str, asset: str) -> str:
     # Link tới một tag/version cụ thể (vd: v1.2.3)
     return f"https://github.com/{owner}/{repo}/releases/download/{tag}/{asset}"
 
+# owner/repo/asset cố định theo env -> dựng sẵn 1 lần
+GITHUB_LATEST_URL = _gh_latest_asset_url(GITHUB_OWNER, GITHUB_REPO, GITHUB_ASSET)
+
 
 def now_local() -> dt.datetime:
     """Datetime tz-aware tại Asia/Bangkok."""
@@ -59,13 +66,13 @@ def now_local_minute() -> dt.datetime:
     d = now_local()
     return d.replace(second=0, microsecond=0)
 
-def now_local_naive() -> dt.datetime:
-    """Giờ Asia/Bangkok nhưng NAIVE (không tzinfo) để lưu DB & so sánh."""
-    return now_local().replace(tzinfo=None)
+@lru_cache(maxsize=2)
+def _local_minute_naive(epoch_minute: int) -> dt.datetime:
+    return dt.datetime.fromtimestamp(epoch_minute * 60, LOCAL_TZ).replace(tzinfo=None)
 
 def now_local_minute_naive() -> dt.datetime:
-    """Asia/Bangkok, cắt tới phút, NAIVE."""
-    return now_local_minute().replace(tzinfo=None)
+    """Asia/Bangkok, cắt tới phút, NAIVE (cache theo phút hiện tại)."""
+    return _local_minute_naive(int(time.time() // 60))
 
 def to_iso_local_naive(x: dt.datetime | None) -> str | None:
     """
@@ -73,96 +80,231 @@ def to_iso_local_naive(x: dt.datetime | None) -> str | None:
     """
     if not x:
         return None
-    aware = x.replace(tzinfo=LOCAL_TZ)
+    # Asia/Bangkok cố định +07:00 (không DST) -> nối chuỗi offset, bỏ tra ZoneInfo mỗi dòng
     # seconds cho gọn: 2025-09-15T12:34:00+07:00
-    return aware.isoformat(timespec="seconds")
+    return x.isoformat(timespec="seconds") + _LOCAL_OFFSET_STR
 
 
 # ================== Config ==================
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "change-me")
+ADMIN_TOKEN_BYTES = ADMIN_TOKEN.encode()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data.db")
+ENABLE_ADMIN = os.getenv("ENABLE_ADMIN", "1") == "1"
 
 # ================== DB ==================
-engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
-
-def get_session():
-    with Session(engine) as s:
+def _async_url(url: str) -> str:
+    """Đổi URL driver sync (pymysql/psycopg2/sqlite3) sang driver async tương ứng."""
+    for sync_prefix, async_prefix in (
+        ("sqlite://", "sqlite+aiosqlite://"),
+        ("postgres://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("mysql://", "mysql+aiomysql://"),
+        ("mysql+pymysql://", "mysql+aiomysql://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+def _engine_kwargs(url: str) -> dict:
+    """Tham số pool theo backend; SQLite (file) để pool mặc định của SQLAlchemy."""
+    if url.startswith("sqlite"):
+        return {}
+    kwargs = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        # tránh kết nối bị MySQL/Postgres (hoặc proxy/LB của nhà cung cấp) đóng do idle
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+    if _async_url(url).startswith("postgresql+asyncpg"):
+        # đặt tên kết nối để dễ lọc trong pg_stat_activity
+        connect_args = {"server_settings": {"application_name": os.getenv("DB_APP_NAME", "tkt_api")}}
+        if _behind_pgbouncer(url):
+            # PgBouncer transaction pool: mỗi transaction có thể sang backend khác -> tắt cache
+            # prepared statement của asyncpg/SQLAlchemy và đặt tên statement không trùng
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+        kwargs["connect_args"] = connect_args
+    return kwargs
+
+def _behind_pgbouncer(url: str) -> bool:
+    """DB_PGBOUNCER=1 hoặc URL trỏ tới cổng mặc định của PgBouncer (6432)."""
+    if os.getenv("DB_PGBOUNCER") is not None:
+        return os.getenv("DB_PGBOUNCER") == "1"
+    return make_url(url).port == 6432
+
+engine = create_async_engine(
+    _async_url(DATABASE_URL), echo=False, pool_pre_ping=True, **_engine_kwargs(DATABASE_URL)
+)
+
+DB_DIALECT = engine.dialect.name  # 'sqlite' | 'postgresql' | 'mysql'
+
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # reader không bị writer chặn
+    "PRAGMA synchronous=NORMAL",    # fsync theo checkpoint thay vì mỗi commit
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",     # ~64MB page cache / kết nối
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+if DB_DIALECT == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for pragma in _SQLITE_PRAGMAS:
+            cur.execute(pragma)
+        cur.close()
+
+async def get_session():
+    # expire_on_commit=False: tránh lazy-load (không được phép trong async) sau commit
+    async with AsyncSession(engine, expire_on_commit=False) as s:
         yield s
 
 # ================== Models ==================
-class License(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    key: str = Field(index=True, unique=True, nullable=False, max_length=64)
-    license: Optional[str] = Field(default=None, sa_column=Column(Text))
-    status: str = Field(default="active", max_length=16)
-    plan: Optional[str] = Field(default=None, max_length=32)
-    max_version: str = Field(default="0.0.1", max_length=50)
-    max_devices: int = Field(default=1)
-    expires_at: Optional[dt.datetime] = Field(default=None)
-    notes: Optional[str] = Field(default=None)
-    created_at: dt.datetime = Field(default_factory=now_local_naive, index=True)
-    updated_at: dt.datetime = Field(default_factory=now_local_naive, index=True)
-
-    __table_args__ = (
-        CheckConstraint("status in ('active','revoked','deleted')", name="ck_license_status"),
-        Index("ix_license_created_at", "created_at"),
-        Index("ix_license_updated_at", "updated_at"),
-    )
-
-class Device(SQLModel, table=True):
-    # Bảng quản lý máy sử dụng license
-    id: Optional[int] = Field(default=None, primary_key=True)
-    license_id: int = Field(index=True, foreign_key="license.id")
-    hwid: str = Field(index=True)
-    hostname: Optional[str] = None
-    platform: Optional[str] = None
-    app_ver: Optional[str] = None
-    created_at: dt.datetime = Field(default_factory=now_local_naive, index=True)
-    last_seen_at: Optional[dt.datetime] = None
+# Khai báo bảng nằm ở models.py (Alembic import riêng, không kéo theo FastAPI/sqladmin)
+from models import License, Device, Activation, DownloadLog
 
-    __table_args__ = (
-        UniqueConstraint("license_id", "hwid", name="uq_device_license_hwid"),
-    )
+# ================== Auth ==================
+bearer = HTTPBearer(auto_error=False)
 
-class Activation(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    license_key: str = Field(index=True, max_length=64)
-    hwid: str = Field(max_length=255)
-    created_at: dt.datetime = Field(default_factory=now_local_naive, index=True)
-    last_seen_at: Optional[dt.datetime] = None
+def _admin_token_ok(token: str | None) -> bool:
+    """So khớp ADMIN_TOKEN thời gian hằng (chống timing attack)."""
+    return bool(token) and hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN_BYTES)
 
-    __table_args__ = (
-        UniqueConstraint("license_key", "hwid", name="uq_activation_license_hwid"),
-        Index("ix_activation_created_at", "created_at"),
-    )
-class DownloadLog(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    path: str = Field(index=True, max_length=255)
-    ua: Optional[str] = Field(default=None)
-    ip: Optional[str] = Field(default=None)
-    ref: Optional[str] = Field(default=None)
-    created_at: dt.datetime = Field(default_factory=now_local_naive, index=True)
+def _admin_headers_ok(authorization: str | None, x_admin_token: str | None) -> bool:
+    """Dùng chung cho admin_auth và middleware /admin: Bearer hoặc X-Admin-Token."""
+    if authorization and authorization.startswith("Bearer ") and _admin_token_ok(authorization[7:]):
+        return True
+    return _admin_token_ok(x_admin_token)
 
-# ================== Auth ==================
-bearer = HTTPBearer(auto_error=False)
 def admin_auth(
     creds: HTTPAuthorizationCredentials = Depends(bearer),
     x_admin_token: str | None = Header(None, alias="X-Admin-Token")
 ):
-    token = creds.credentials if creds else None
-    if not token and x_admin_token:
-        token = x_admin_token.strip()
-    if token != ADMIN_TOKEN:
+    if not (_admin_token_ok(creds.credentials if creds else None) or _admin_token_ok(x_admin_token)):
         raise HTTPException(401, "Unauthorized")
     return True
 
 # ================== Keys ==================
 PRIV = None
 PUB_PEM = None
+PUB_KEY = None
 KID = None
 
 # ================== Helpers ==================
+# Cache payload của token đã verify (key = blake2b(token)) để /validate không phải
+# chạy lại Ed25519 verify cho cùng một token trong vòng TTL. Hạn "e" kiểm lại mỗi lần
+# trúng cache; thu hồi không phụ thuộc cache này (/validate luôn đọc status license
+# từ DB) -> TTL dài được.
+_TOKEN_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+def _verify_token_cached(token: str) -> dict:
+    h = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    payload = _TOKEN_CACHE.get(h)
+    if payload is not None:
+        # token hết hạn trong lúc còn nằm trong cache -> không trả về kết quả dương
+        exp = payload.get("e")
+        if exp is not None and exp < time.time():
+            _TOKEN_CACHE.pop(h, None)
+            raise ValueError("expired")
+        return payload
+    payload = verify_token(PUB_KEY, token)
+    _TOKEN_CACHE[h] = payload
+    return payload
+
+# last_seen_at chỉ mang tính tham khảo -> /validate ghi vào buffer trong RAM,
+# task nền gom lại và UPDATE 1 lần (executemany) mỗi LAST_SEEN_FLUSH_SECS giây.
+LAST_SEEN_FLUSH_SECS = float(os.getenv("LAST_SEEN_FLUSH_SECS", "10"))
+# khoá theo activation.id (đã có sẵn từ query của /validate) -> UPDATE theo PK
+_LAST_SEEN: dict[int, dt.datetime] = {}
+_UPD_LAST_SEEN = (
+    update(Activation.__table__)
+    .where(Activation.__table__.c.id == bindparam("aid"))
+    .values(last_seen_at=bindparam("ts"))
+)
+
+async def _flush_last_seen(conn: AsyncConnection) -> None:
+    global _LAST_SEEN
+    if not _LAST_SEEN:
+        return
+    batch, _LAST_SEEN = _LAST_SEEN, {}
+    try:
+        async with conn.begin():
+            await conn.execute(_UPD_LAST_SEEN, [{"aid": aid, "ts": ts} for aid, ts in batch.items()])
+    except Exception:
+        # lỗi DB: trả lại buffer (giá trị mới hơn nếu có thì giữ), lần sau flush tiếp
+        for k, ts in batch.items():
+            _LAST_SEEN.setdefault(k, ts)
+
+# Log tải xuống: redirect không chờ INSERT, chỉ append vào buffer (có giới hạn,
+# đầy thì bỏ qua log) -> cùng task nền insert cả lô (executemany).
+DOWNLOAD_LOG_MAX = int(os.getenv("DOWNLOAD_LOG_MAX", "10000"))
+_DOWNLOAD_LOGS: list[dict] = []
+# path/ua/ref do client gửi, cột VARCHAR(255) -> cắt trước để MySQL strict không từ chối cả lô
+_LOG_FIELD_MAX = 255
+
+def _clip(s: Optional[str]) -> Optional[str]:
+    return s[:_LOG_FIELD_MAX] if s else s
+
+def _log_download(request: Request, path: str) -> None:
+    if len(_DOWNLOAD_LOGS) >= DOWNLOAD_LOG_MAX:
+        return
+    h = request.headers
+    _DOWNLOAD_LOGS.append({
+        "path": _clip(path),
+        "ua": _clip(h.get("user-agent")),
+        "ip": _client_ip(request, h.get("x-forwarded-for", "")),
+        "ref": _clip(h.get("referer")),
+        "created_at": now_local_naive(),
+    })
+
+async def _flush_download_logs(conn: AsyncConnection) -> None:
+    global _DOWNLOAD_LOGS
+    if not _DOWNLOAD_LOGS:
+        return
+    batch, _DOWNLOAD_LOGS = _DOWNLOAD_LOGS, []
+    ins = DownloadLog.__table__.insert()
+    try:
+        async with conn.begin():
+            await conn.execute(ins, batch)
+    except Exception:
+        # lô lỗi: thử lại từng dòng, dòng nào lỗi thì bỏ (không xếp lại hàng đợi ->
+        # 1 dòng hỏng không chặn log mãi); không chặn tải nếu ghi log lỗi
+        for row in batch:
+            try:
+                async with conn.begin():
+                    await conn.execute(ins, row)
+            except Exception:
+                pass
+
+async def _flush_buffers() -> None:
+    # 1 lần checkout connection cho cả 2 buffer; mỗi buffer 1 transaction riêng
+    # để lỗi của buffer này không làm mất lô của buffer kia
+    if not _LAST_SEEN and not _DOWNLOAD_LOGS:
+        return
+    try:
+        async with engine.connect() as conn:
+            await _flush_last_seen(conn)
+            await _flush_download_logs(conn)
+    except Exception:
+        # không lấy được connection: buffer còn nguyên, lần sau flush tiếp
+        pass
+
+# shutdown set event -> vòng lặp xong lô đang ghi rồi flush lần cuối, không bị cắt giữa chừng
+_FLUSH_STOP = asyncio.Event()
+
+async def _background_flush_loop() -> None:
+    while not _FLUSH_STOP.is_set():
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_FLUSH_STOP.wait(), LAST_SEEN_FLUSH_SECS)
+        await _flush_buffers()
+
+@lru_cache(maxsize=2048)
 def _parse_semver(s: Optional[str]) -> tuple[int, int, int]:
+    # chuỗi version lặp lại rất nhiều giữa các request -> cache kết quả
     if not s:
         return (0, 0, 0)
     parts = (s or "").strip().split(".")
@@ -178,121 +320,323 @@ def _version_lte(a: Optional[str], b: Optional[str]) -> bool:
     """a <= b theo semver đơn giản x.y.z."""
     return _parse_semver(a) <= _parse_semver(b)
 
-def scalar_int(db: Session, stmt) -> int:
-    """Lấy về 1 số nguyên từ SELECT COUNT(*) ... an toàn cho mọi driver."""
-    res = db.exec(stmt)
-    if hasattr(res, "scalar_one"):
-        try:
-            return int(res.scalar_one() or 0)
-        except Exception:
-            pass
-    val = res.one()
-    return int((val[0] if isinstance(val, tuple) else val) or 0)
-
-def _public_license_dict(lic: License, db: Session, app_ver: Optional[str] = None) -> dict:
-    expired = bool(lic.expires_at and lic.expires_at < now_local_naive())
-    used_devices_count = scalar_int(db, select(func.count(Device.id)).where(Device.license_id == lic.id))
+async def _upsert_returning_id(db: AsyncSession, table, values: dict, conflict_cols: List[str], update: dict) -> int:
+    """INSERT ... ON CONFLICT DO UPDATE (MySQL: ON DUPLICATE KEY UPDATE), trả về id của dòng trong 1 round-trip."""
+    if DB_DIALECT == "mysql":
+        # LAST_INSERT_ID(id) để lastrowid trả về id cả khi rơi vào nhánh UPDATE
+        stmt = mysql_insert(table).values(**values).on_duplicate_key_update(
+            id=func.last_insert_id(table.c.id), **update
+        )
+        return (await db.exec(stmt)).lastrowid
+    insert = pg_insert if DB_DIALECT == "postgresql" else sqlite_insert
+    stmt = (
+        insert(table).values(**values)
+        .on_conflict_do_update(index_elements=conflict_cols, set_=update)
+        .returning(table.c.id)
+    )
+    return (await db.exec(stmt)).scalar_one()
 
-    resp = {
-        "key": lic.key,
-        "status": lic.status,
-        "plan": lic.plan,
-        "max_devices": lic.max_devices,
-        "used_devices": used_devices_count,
-        "max_version": lic.max_version,
-        "expires_at": to_iso_local_naive(lic.expires_at),
-        "license": lic.license,
-        "kid": KID,
-        "now": int(time.time()),
-        "expired": expired,
-    }
-    if app_ver is not None and lic.max_version:
-        resp["app_ver"] = app_ver
-        resp["app_allowed"] = _version_lte(app_ver, lic.max_version)
+async def _insert_ignore(db: AsyncSession, table, values: dict, conflict_cols: List[str]) -> bool:
+    """INSERT ... ON CONFLICT DO NOTHING (MySQL: INSERT IGNORE); True nếu thật sự chèn dòng mới."""
+    if DB_DIALECT == "mysql":
+        stmt = mysql_insert(table).values(**values).prefix_with("IGNORE")
+    else:
+        insert = pg_insert if DB_DIALECT == "postgresql" else sqlite_insert
+        stmt = insert(table).values(**values).on_conflict_do_nothing(index_elements=conflict_cols)
+    return (await db.exec(stmt)).rowcount == 1
+
+# Số device đang dùng, tính bằng subquery tương quan -> đi kèm luôn trong SELECT License
+_USED_DEVICES = (
+    select(func.count(Device.id))
+    .where(Device.license_id == License.id)
+    .correlate(License)
+    .scalar_subquery()
+)
+
+# Câu SELECT theo key dựng sẵn 1 lần lúc import (bind :k), endpoint chỉ truyền params.
+# Chỉ lấy các cột endpoint public cần -> Row (truy cập lic.status, ...) thay vì dựng object ORM.
+_LIC_COLS = (
+    License.id, License.key, License.status, License.plan, License.max_devices,
+    License.max_version, License.expires_at, License.license,
+)
+_SEL_LIC_BY_KEY = select(*_LIC_COLS).where(License.key == bindparam("k"))
+_SEL_LIC_USED_BY_KEY = select(*_LIC_COLS, _USED_DEVICES.label("used")).where(License.key == bindparam("k"))
+
+# Cache (License, used_devices) theo key cho các lookup public (chỉ đọc).
+# Xoá khi admin sửa/thu hồi/xoá license hoặc khi đăng ký device (đổi used_devices).
+_LIC_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=30)
+# Cache Row license (không kèm used) cho /activate, /devices/register: seat vẫn đếm trực tiếp từ DB
+_LIC_ROW_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+
+def _invalidate_license_cache(*keys: str) -> None:
+    for k in keys:
+        _LIC_CACHE.pop(k, None)
+        _LIC_ROW_CACHE.pop(k, None)
+
+# Gộp các lần cache-miss đồng thời cùng key thành 1 SELECT (single-flight):
+# request đầu chạy query, các request đến sau trong lúc đó chờ chung kết quả.
+_LIC_ROW_INFLIGHT: dict[str, asyncio.Future] = {}
+_LIC_USED_INFLIGHT: dict[str, asyncio.Future] = {}
+
+async def _coalesce(inflight: dict, key: str, load):
+    fut = inflight.get(key)
+    if fut is not None:
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            if not fut.cancelled():
+                raise
+            # request dẫn đầu bị huỷ -> tự query
+            return await load()
+    fut = inflight[key] = asyncio.get_running_loop().create_future()
+    try:
+        res = await load()
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # đánh dấu đã đọc, tránh log "never retrieved" khi không ai chờ
+        raise
+    except BaseException:
+        fut.cancel()
+        raise
+    else:
+        fut.set_result(res)
+        return res
+    finally:
+        inflight.pop(key, None)
+
+async def _get_license_row(db: AsyncSession, key: str) -> Optional[Row]:
+    row = _LIC_ROW_CACHE.get(key)
+    if row is None:
+        async def load():
+            return (await db.exec(_SEL_LIC_BY_KEY, params={"k": key})).first()
+        row = await _coalesce(_LIC_ROW_INFLIGHT, key, load)
+        if row is not None:
+            _LIC_ROW_CACHE[key] = row
+    return row
+
+_SEL_VALIDATE = (
+    select(License.status, License.plan, License.max_devices, Activation.id.label("act_id"))
+    .outerjoin(Activation, and_(Activation.license_id == License.id, Activation.hwid == bindparam("h")))
+    .where(License.key == bindparam("k"))
+)
+
+# Seat đã dùng + hwid này đã có chưa (1 query tổng hợp) cho /activate và /devices/register
+_SEL_ACTIVATION_SEATS = select(
+    func.count(Activation.id),
+    func.coalesce(func.sum(case((Activation.hwid == bindparam("h"), 1), else_=0)), 0),
+).where(Activation.license_id == bindparam("lid"))
+_SEL_DEVICE_SEATS = select(
+    func.count(Device.id),
+    func.coalesce(func.sum(case((Device.hwid == bindparam("h"), 1), else_=0)), 0),
+).where(Device.license_id == bindparam("lid"))
+# Đếm lại sau upsert: used_devices trả về phải gồm cả máy đăng ký song song
+_SEL_DEVICE_COUNT = select(func.count(Device.id)).where(Device.license_id == bindparam("lid"))
+# Core DELETE trên __table__ (như _UPD_LAST_SEEN): bản ORM phải synchronize_session='fetch'
+# vì WHERE có subquery -> thêm RETURNING / SELECT trước (MySQL), mất ý nghĩa xoá thẳng
+_DEL_ACTIVATION = delete(Activation.__table__).where(
+    Activation.__table__.c.license_id == select(License.id).where(License.key == bindparam("k")).scalar_subquery(),
+    Activation.__table__.c.hwid == bindparam("h"),
+)
+
+async def _get_active_license_with_used(db: AsyncSession, key: str) -> tuple[Row, int]:
+    """License + số device đã dùng (cache TTL, miss -> 1 round-trip); 404 nếu không có, 403 nếu không active."""
+    row = _LIC_CACHE.get(key)
+    if row is None:
+        async def load():
+            return (await db.exec(_SEL_LIC_USED_BY_KEY, params={"k": key})).first()
+        row = await _coalesce(_LIC_USED_INFLIGHT, key, load)
+        if not row:
+            raise HTTPException(404, "Not found")
+        row = _LIC_CACHE[key] = (row, int(row.used or 0))
+    lic, used = row
+    if lic.status != "active":
+        raise HTTPException(403, "License invalid")
+    return lic, used
+
+# Phần tĩnh của response public theo (row license, used, app_ver); "now"/"expired" tính lại mỗi lần
+_PUBLIC_DICT_CACHE: TTLCache = TTLCache(maxsize=8192, ttl=15)
+
+def _public_license_dict(lic: Row, used_devices: int, app_ver: Optional[str] = None) -> dict:
+    ck = (lic, used_devices, app_ver)
+    base = _PUBLIC_DICT_CACHE.get(ck)
+    if base is None:
+        base = {
+            "key": lic.key,
+            "status": lic.status,
+            "plan": lic.plan,
+            "max_devices": lic.max_devices,
+            "used_devices": used_devices,
+            "max_version": lic.max_version,
+            "expires_at": to_iso_local_naive(lic.expires_at),
+            "license": lic.license,
+            "kid": KID,
+            "now": 0,
+            "expired": False,
+        }
+        if app_ver is not None and lic.max_version:
+            base["app_ver"] = app_ver
+            base["app_allowed"] = _version_lte(app_ver, lic.max_version)
+        _PUBLIC_DICT_CACHE[ck] = base
+
+    resp = dict(base)
+    resp["now"] = int(time.time())
+    resp["expired"] = bool(lic.expires_at and lic.expires_at < now_local_naive())
     return resp
 
-def _client_ip(request: Request) -> str:
-    # Render/Proxy thường gửi X-Forwarded-For
-    xff = request.headers.get("X-Forwarded-For")
+def _client_ip(request: Request, xff: Optional[str] = None) -> str:
+    # Render/Proxy thường gửi X-Forwarded-For (caller đã đọc header thì truyền vào, khỏi quét lại)
+    if xff is None:
+        xff = request.headers.get("x-forwarded-for")
     if xff:
-        return xff.split(",")[0].strip()
+        # chỉ lấy hop đầu tiên, không tách cả header (XFF có thể rất dài)
+        return xff.partition(",")[0].strip()
     return getattr(request.client, "host", "") or ""
 
+# Cursor keyset của list_licenses: base64url(JSON [sort_by, sort_dir, giá trị cột sort, id])
+def _encode_cursor(sort_by: str, sort_dir: str, value, row_id: int) -> str:
+    if isinstance(value, dt.datetime):
+        value = value.isoformat()
+    raw = orjson.dumps([sort_by, sort_dir, value, row_id])
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+def _decode_cursor(cursor: str, sort_by: str, sort_dir: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        c_sort, c_dir, value, row_id = orjson.loads(raw)
+        if (c_sort, c_dir) != (sort_by, sort_dir):
+            raise ValueError("sort mismatch")
+        if sort_by != "key":
+            value = dt.datetime.fromisoformat(value)
+        return value, int(row_id)
+    except Exception:
+        raise HTTPException(422, "cursor không hợp lệ (hoặc khác sort_by/sort_dir)")
+
 # ================== App ==================
 BOOT_TS = time.time()
-app = FastAPI(title="License Server (Render)", version="1.0.0")
+class OrjsonResponse(JSONResponse):
+    """JSON encode bằng orjson (C) thay cho json.dumps; dùng làm response mặc định của app."""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+app = FastAPI(title="License Server (Render)", version="1.0.0", default_response_class=OrjsonResponse)
 
 # ---- SQLAdmin & middleware bảo vệ /admin ----
-class AdminAuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        if request.url.path.startswith("/admin"):
-            expect = ADMIN_TOKEN
-            ok = False
-            auth = request.headers.get("Authorization", "")
-            if auth.startswith("Bearer "):
-                ok = (auth.split(" ", 1)[1].strip() == expect)
-            if not ok:
-                xadm = request.headers.get("X-Admin-Token")
-                ok = bool(xadm and xadm.strip() == expect)
-            if not ok:
-                return Response("Unauthorized", status_code=401)
-        return await call_next(request)
-
-app.add_middleware(AdminAuthMiddleware)
-admin = Admin(app, engine)
-
-class LicenseAdmin(ModelView, model=License):
-    name = "License"; name_plural = "Licenses"
-    column_list = [
-        License.id, License.key, License.status, License.plan,
-        License.max_devices, License.expires_at, License.created_at, License.updated_at
-    ]
-    column_searchable_list = [License.key, License.plan, License.status]
-    column_sortable_list = [License.id, License.created_at, License.expires_at, License.updated_at]
-
-class ActivationAdmin(ModelView, model=Activation):
-    name = "Activation"; name_plural = "Activations"
-    column_list = [
-        Activation.id, Activation.license_key, Activation.hwid,
-        Activation.created_at, Activation.last_seen_at
-    ]
-    column_searchable_list = [Activation.license_key, Activation.hwid]
-    column_sortable_list = [Activation.id, Activation.created_at, Activation.last_seen_at]
-
-admin.add_view(LicenseAdmin)
-admin.add_view(ActivationAdmin)
+# sqladmin (kéo theo wtforms, jinja2, ...) chỉ import khi bật ENABLE_ADMIN -> khởi động nhanh/nhẹ hơn
+def _setup_admin(app: FastAPI) -> None:
+    from sqladmin import Admin, ModelView
+
+    class AdminAuthMiddleware:
+        # ASGI thuần (không BaseHTTPMiddleware): request ngoài /admin đi thẳng xuống app,
+        # không qua memory stream + task group
+        def __init__(self, app):
+            self.app = app
+
+        async def __call__(self, scope, receive, send):
+            if scope["type"] == "http" and scope["path"].startswith("/admin"):
+                authorization = x_admin_token = None
+                for name, value in scope["headers"]:
+                    if name == b"authorization":
+                        authorization = value.decode("latin-1")
+                    elif name == b"x-admin-token":
+                        x_admin_token = value.decode("latin-1")
+                if not _admin_headers_ok(authorization, x_admin_token):
+                    await Response("Unauthorized", status_code=401)(scope, receive, send)
+                    return
+            await self.app(scope, receive, send)
+
+    app.add_middleware(AdminAuthMiddleware)
+    admin = Admin(app, engine)
+
+    class LicenseAdmin(ModelView, model=License):
+        name = "License"; name_plural = "Licenses"
+        column_list = [
+            License.id, License.key, License.status, License.plan,
+            License.max_devices, License.expires_at, License.created_at, License.updated_at
+        ]
+        column_searchable_list = [License.key, License.plan, License.status]
+        column_sortable_list = [License.id, License.created_at, License.expires_at, License.updated_at]
+
+    class ActivationAdmin(ModelView, model=Activation):
+        name = "Activation"; name_plural = "Activations"
+        column_list = [
+            Activation.id, Activation.license_id, Activation.hwid,
+            Activation.created_at, Activation.last_seen_at
+        ]
+        column_searchable_list = [Activation.hwid]
+        column_sortable_list = [Activation.id, Activation.created_at, Activation.last_seen_at]
+
+    admin.add_view(LicenseAdmin)
+    admin.add_view(ActivationAdmin)
+
+if ENABLE_ADMIN:
+    _setup_admin(app)
 # -------------------------------------------
 
 # ================== Lifecycle & Static ==================
+FAVICON_PATH = os.path.join(os.path.dirname(__file__), "static", "favicon.ico")
+FAVICON: bytes | None = None
+FAVICON_ETAG = ""
+_FLUSH_TASK: asyncio.Task | None = None
+
+def _etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+def _static_response(request: Request, body: bytes, etag: str, media_type: str, max_age: int) -> Response:
+    """Nội dung tĩnh trong RAM: trả 304 nếu If-None-Match khớp ETag, ngược lại trả body."""
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in inm.split(","))):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+def _read_favicon() -> bytes | None:
+    """Đọc favicon 1 lần lúc startup (không có file -> None, handler trả 204)."""
+    try:
+        with open(FAVICON_PATH, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
 @app.on_event("startup")
-def startup():
-    global PRIV, PUB_PEM, KID
-    SQLModel.metadata.create_all(engine)
-    PRIV, PUB_PEM = load_keys_from_env()
+async def startup():
+    global PRIV, PUB_PEM, PUB_KEY, KID, FAVICON, FAVICON_ETAG, _FLUSH_TASK
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    priv, PUB_PEM = load_keys_from_env()
+    PRIV = load_signing_key(priv)
+    PUB_KEY = load_public_key(PUB_PEM)
     KID = kid_from_pub(PUB_PEM)
+    FAVICON = _read_favicon()
+    FAVICON_ETAG = _etag(FAVICON) if FAVICON is not None else ""
+    _FLUSH_TASK = asyncio.create_task(_background_flush_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _FLUSH_TASK:
+        _FLUSH_STOP.set()
+        await _FLUSH_TASK
+    await _flush_buffers()
 
 @app.get("/health")
-def health():
+async def health():
     return {"ok": True, "kid": KID}
 
 @app.get("/healthz")
-def healthz():
+async def healthz():
     return {"status": "ok", "uptime": round(time.time() - BOOT_TS, 2)}
 
 @app.get("/ready")
-def ready():
+async def ready():
     return {"ready": True, "kid": KID}
 
-@app.get("/", response_class=HTMLResponse)
-def index():
-    uptime = round(time.time() - BOOT_TS, 2)
-    return f"""<!doctype html>
+# Trang chủ không có trường động -> dựng sẵn (đã encode) 1 lần lúc import, handler chỉ trả bytes
+_INDEX_HTML = """<!doctype html>
 <html lang="vi">
 <head>
     <meta charset="utf-8">
     <title>TKT FastAPI</title>
     <style>
-        body {{
+        body {
             font-family: system-ui, -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, 'Open Sans', 'Helvetica Neue', sans-serif;
             max-width: 720px;
             margin: 40px auto;
@@ -300,43 +644,43 @@ def index():
             color: #333;
             background-color: #f9f9f9;
             padding: 20px;
-        }}
-        h1 {{
+        }
+        h1 {
             color: #28a745; /* Green for success/live */
             font-size: 2.5em;
             margin-bottom: 10px;
             display: flex;
             align-items: center;
-        }}
-        h1::before {{
+        }
+        h1::before {
             content: "✅ ";
             margin-right: 10px;
-        }}
-        h4 {{
+        }
+        h4 {
             font-style: italic;
             color: #666;
             margin-top: 0;
             margin-bottom: 20px;
-        }}
-        p {{
+        }
+        p {
             margin: 10px 0;
             font-size: 1.1em;
-        }}
-        code {{
+        }
+        code {
             background-color: #e9ecef;
             padding: 2px 6px;
             border-radius: 4px;
             font-family: monospace;
-        }}
-        ul {{
+        }
+        ul {
             list-style-type: none;
             padding: 0;
             margin: 20px 0;
-        }}
-        li {{
+        }
+        li {
             margin-bottom: 10px;
-        }}
-        a {{
+        }
+        a {
             display: inline-block;
             text-decoration: none;
             color: #007bff;
@@ -345,22 +689,22 @@ def index():
             border: 1px solid #ddd;
             border-radius: 5px;
             transition: background-color 0.3s, color 0.3s;
-        }}
-        a:hover {{
+        }
+        a:hover {
             background-color: #007bff;
             color: #fff;
-        }}
-        .note {{
+        }
+        .note {
             font-size: 0.9em;
             color: #555;
             margin-left: 10px;
-        }}
-        .container {{
+        }
+        .container {
             background-color: #fff;
             padding: 30px;
             border-radius: 10px;
             box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-        }}
+        }
     </style>
 </head>
 <body>
@@ -377,18 +721,22 @@ def index():
     </div>
 </body>
 </html>
-"""
+""".encode("utf-8")
+_INDEX_ETAG = _etag(_INDEX_HTML)
+
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    return _static_response(request, _INDEX_HTML, _INDEX_ETAG, "text/html", 60)
 
 @app.head("/")
-def index_head():
+async def index_head():
     return Response(status_code=200)
 
 @app.get("/favicon.ico")
-def favicon():
-    path = os.path.join(os.path.dirname(__file__), "static", "favicon.ico")
-    if os.path.exists(path):
-        return FileResponse(path, media_type="image/x-icon")
-    return Response(status_code=204)
+async def favicon(request: Request):
+    if FAVICON is None:
+        return Response(status_code=204)
+    return _static_response(request, FAVICON, FAVICON_ETAG, "image/x-icon", 86400)
 
 # ================== Schemas ==================
 class LicenseCreate(BaseModel):
@@ -438,10 +786,17 @@ class LicenseItem(BaseModel):
 
 class LicenseListResponse(BaseModel):
     items: List[LicenseItem]
-    total: int
+    total: Optional[int] = None
     page: int
     page_size: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+class LicenseBulkIn(BaseModel):
+    keys: List[str] = PydField(min_length=1, max_length=1000)
+
+class LicenseBulkExtendIn(LicenseBulkIn):
+    expires_days: int = PydField(ge=1)
 
 class DeviceRegisterIn(BaseModel):
     key: str
@@ -454,45 +809,43 @@ class DeviceRegisterIn(BaseModel):
 ALLOWED_PLANS = {"Free", "Plus", "Pro"}
 
 @app.post("/licenses", dependencies=[Depends(admin_auth)])
-def create_license(data: LicenseCreate, db: Session = Depends(get_session)):
+async def create_license(data: LicenseCreate, db: AsyncSession = Depends(get_session)):
     if data.plan and data.plan not in ALLOWED_PLANS:
         raise HTTPException(status_code=422, detail=f"plan phải thuộc {sorted(ALLOWED_PLANS)}")
 
-    # sinh hoặc dùng key truyền lên
-    key = data.key or generate_short_key()
-    tries = 0
-    while db.exec(select(License).where(License.key == key)).first():
-        tries += 1
-        if tries > 5:
-            raise HTTPException(500, "Cannot generate unique key")
-        key = generate_short_key()
-
-    lic = License(key=key)
-
+    fields = {}
     if data.license is not None:
-        lic.license = data.license
+        fields["license"] = data.license
     if data.plan is not None:
-        lic.plan = data.plan
+        fields["plan"] = data.plan
     if data.max_devices is not None:
-        lic.max_devices = data.max_devices
+        fields["max_devices"] = data.max_devices
     if data.max_version is not None:
-        lic.max_version = data.max_version
+        fields["max_version"] = data.max_version
     if data.notes is not None:
-        lic.notes = data.notes
+        fields["notes"] = data.notes
     if data.expires_days:
         base = now_local_minute_naive() 
-        lic.expires_at = base + dt.timedelta(days=data.expires_days)
+        fields["expires_at"] = base + dt.timedelta(days=data.expires_days)
 
-    try:
-        db.add(lic)
-        db.commit()
-        db.refresh(lic)
-    except IntegrityError:
-        db.rollback()
-        raise HTTPException(status_code=409, detail="Key đã tồn tại hoặc dữ liệu không hợp lệ")
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Lỗi lưu DB: {e}")
+    # sinh hoặc dùng key truyền lên; trùng key (unique) thì sinh key mới và insert lại
+    key = data.key or generate_short_key()
+    for attempt in range(3):
+        lic = License(key=key, **fields)
+        try:
+            db.add(lic)
+            # id lấy từ INSERT (RETURNING/lastrowid), created_at do Python tạo sẵn,
+            # expire_on_commit=False -> không cần refresh (thêm 1 SELECT)
+            await db.commit()
+            break
+        except IntegrityError:
+            await db.rollback()
+            if attempt == 2:
+                raise HTTPException(status_code=409, detail="Key đã tồn tại hoặc dữ liệu không hợp lệ")
+            key = generate_short_key()
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=500, detail=f"Lỗi lưu DB: {e}")
 
     return {
         "id": lic.id,
@@ -506,28 +859,7 @@ def create_license(data: LicenseCreate, db: Session = Depends(get_session)):
         "created_at": to_iso_local_naive(getattr(lic, "created_at", None)),
     }
 
-@app.get("/licenses", response_model=LicenseListResponse, dependencies=[Depends(admin_auth)])
-def list_licenses(
-    db: Session = Depends(get_session),
-    # Tìm kiếm & lọc
-    q: Optional[str] = Query(None, description="Tìm theo key/plan/status (substring)"),
-    status: Optional[str] = Query(None, description="Lọc theo trạng thái: active/revoked/deleted"),
-    plan: Optional[str] = Query(None, description="Lọc theo gói: Free/Plus/Pro"),
-    created_from: Optional[dt.datetime] = Query(None),
-    created_to: Optional[dt.datetime] = Query(None),
-    expires_from: Optional[dt.datetime] = Query(None),
-    expires_to: Optional[dt.datetime] = Query(None),
-    # Phân trang
-    page: int = Query(1, ge=1),
-    page_size: int = Query(20, ge=1, le=200),
-    # Sắp xếp
-    sort_by: str = Query("created_at", pattern="^(created_at|updated_at|expires_at|key)$"),
-    sort_dir: str = Query("desc", pattern="^(asc|desc)$"),
-):
-    def _iso(x: Optional[dt.datetime]) -> Optional[str]:
-        return to_iso_local_naive(x)
-
-    # ----- Build bộ lọc -----
+def _license_filters(q, status, plan, created_from, created_to, expires_from, expires_to) -> list:
     filters = []
     if q:
         like = f"%{q}%"
@@ -546,180 +878,341 @@ def list_licenses(
     if expires_to:
         filters.append(License.expires_at != None)
         filters.append(License.expires_at <= expires_to)
+    return filters
+
+_LICENSE_SORT_COLS = {
+    "created_at": License.created_at,
+    "updated_at": License.updated_at,
+    "expires_at": License.expires_at,
+    "key": License.key,
+}
+
+_LICENSE_ITEM_COLS = (
+    License.id, License.key, License.status, License.plan, License.max_devices,
+    License.max_version, License.expires_at, License.created_at, License.updated_at,
+)
+
+def _license_item(lic, used) -> dict:
+    """1 dòng của /licenses và /licenses/stream (lic: License hoặc Row cùng tên cột)."""
+    iso = to_iso_local_naive
+    return {
+        "id": lic.id,
+        "key": lic.key,
+        "status": lic.status,
+        "plan": lic.plan,
+        "max_devices": lic.max_devices,
+        "used_devices": int(used or 0),
+        "max_version": lic.max_version,
+        "expires_at": iso(lic.expires_at),
+        "created_at": iso(lic.created_at),
+        "updated_at": iso(lic.updated_at),
+    }
 
+@app.get("/licenses", response_model=LicenseListResponse, dependencies=[Depends(admin_auth)])
+async def list_licenses(
+    db: AsyncSession = Depends(get_session),
+    # Tìm kiếm & lọc
+    q: Optional[str] = Query(None, description="Tìm theo key/plan/status (substring)"),
+    status: Optional[str] = Query(None, description="Lọc theo trạng thái: active/revoked/deleted"),
+    plan: Optional[str] = Query(None, description="Lọc theo gói: Free/Plus/Pro"),
+    created_from: Optional[dt.datetime] = Query(None),
+    created_to: Optional[dt.datetime] = Query(None),
+    expires_from: Optional[dt.datetime] = Query(None),
+    expires_to: Optional[dt.datetime] = Query(None),
+    # Phân trang
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Keyset: next_cursor của trang trước (bỏ qua page, không đếm total)"),
+    include_total: bool = Query(True, description="False để bỏ SELECT COUNT(*)"),
+    # Sắp xếp
+    sort_by: str = Query("created_at", pattern="^(created_at|updated_at|expires_at|key)$"),
+    sort_dir: str = Query("desc", pattern="^(asc|desc)$"),
+):
+    # ----- Build bộ lọc -----
+    filters = _license_filters(q, status, plan, created_from, created_to, expires_from, expires_to)
     where_clause = and_(*filters) if filters else None
 
-    # ----- Tổng số bản ghi -----
-    count_stmt = select(func.count()).select_from(License)
-    if where_clause is not None:
-        count_stmt = count_stmt.where(where_clause)
-    total = db.exec(count_stmt).one()
-    if isinstance(total, tuple):
-        total = total[0]
-    total = int(total)
-
-    # ----- Sắp xếp -----
-    sort_map = {
-        "created_at": License.created_at,
-        "updated_at": License.updated_at,
-        "expires_at": License.expires_at,
-        "key": License.key,
-    }
-    order_col = sort_map.get(sort_by, License.created_at)
-    order_by = order_col.desc() if sort_dir == "desc" else order_col.asc()
-
-    # ----- Lấy dữ liệu theo trang -----
-    offset = (page - 1) * page_size
-    stmt = select(License).order_by(order_by).offset(offset).limit(page_size)
+    # total lấy bằng count(*) OVER () ngay trong câu SELECT trang (bỏ khi đi theo cursor)
+    with_total = include_total and cursor is None
+
+    # ----- Sắp xếp (id làm tie-breaker để thứ tự ổn định cho keyset) -----
+    order_col = _LICENSE_SORT_COLS.get(sort_by, License.created_at)
+    desc = sort_dir == "desc"
+    order_by = (order_col.desc(), License.id.desc()) if desc else (order_col.asc(), License.id.asc())
+
+    # ----- Lấy dữ liệu theo trang (kèm used_devices qua LEFT JOIN, 1 round-trip) -----
+    # chỉ lấy cột cần cho item (bỏ license/notes TEXT), Row thuần -> không dựng entity ORM
+    cols = [*_LICENSE_ITEM_COLS, func.count(Device.id).label("used")]
+    if with_total:
+        cols.append(func.count().over().label("total"))
+    stmt = (
+        select(*cols)
+        .outerjoin(Device, Device.license_id == License.id)
+        .group_by(License.id)
+        .order_by(*order_by)
+        .limit(page_size)
+    )
+    if cursor is not None:
+        if sort_by == "expires_at":
+            raise HTTPException(422, "cursor không hỗ trợ sort_by=expires_at (cột có thể NULL)")
+        value, last_id = _decode_cursor(cursor, sort_by, sort_dir)
+        if desc:
+            stmt = stmt.where(or_(order_col < value, and_(order_col == value, License.id < last_id)))
+        else:
+            stmt = stmt.where(or_(order_col > value, and_(order_col == value, License.id > last_id)))
+    else:
+        stmt = stmt.offset((page - 1) * page_size)
     if where_clause is not None:
         stmt = stmt.where(where_clause)
 
-    licenses: List[License] = db.exec(stmt).all()
-
-    # ----- Tính used_devices -----
-    if licenses:
-        lic_ids = [lic.id for lic in licenses]
-        cnt_stmt = (
-            select(Device.license_id, func.count(Device.id))
-            .where(Device.license_id.in_(lic_ids))
-            .group_by(Device.license_id)
-        )
-        counts = dict(db.exec(cnt_stmt).all())
-    else:
-        counts = {}
+    rows = (await db.exec(stmt)).all()
+
+    total = None
+    if with_total:
+        if rows:
+            total = int(rows[0].total)
+        elif page == 1:
+            total = 0
+        else:
+            # trang vượt quá cuối: window không trả dòng nào -> đếm riêng
+            count_stmt = select(func.count()).select_from(License)
+            if where_clause is not None:
+                count_stmt = count_stmt.where(where_clause)
+            total = int((await db.exec(count_stmt)).one())
 
     # ----- Map ra response items -----
-    items: List[LicenseItem] = []
-    for lic in licenses:
-        items.append(
-            LicenseItem(
-                id=lic.id,
-                key=lic.key,
-                status=lic.status,
-                plan=lic.plan,
-                max_devices=lic.max_devices,
-                used_devices=int(counts.get(lic.id, 0)),
-                max_version=lic.max_version,
-                expires_at=_iso(lic.expires_at),
-                created_at=_iso(getattr(lic, "created_at", None)),
-                updated_at=_iso(getattr(lic, "updated_at", None)),
-            )
-        )
+    # dict thẳng + orjson (bỏ vòng validate LicenseItem); response_model vẫn giữ cho /docs
+    items = [_license_item(row, row.used) for row in rows]
+
+    next_cursor = None
+    if len(rows) == page_size and sort_by != "expires_at":
+        last = rows[-1]
+        next_cursor = _encode_cursor(sort_by, sort_dir, getattr(last, sort_by), last.id)
+
+    pages = (total + page_size - 1) // page_size if total is not None else None
+    return OrjsonResponse({
+        "items": items, "total": total, "page": page, "page_size": page_size,
+        "pages": pages, "next_cursor": next_cursor,
+    })
+
+@app.get("/licenses/stream", dependencies=[Depends(admin_auth)])
+async def stream_licenses(
+    q: Optional[str] = Query(None, description="Tìm theo key/plan/status (substring)"),
+    status: Optional[str] = Query(None),
+    plan: Optional[str] = Query(None),
+    created_from: Optional[dt.datetime] = Query(None),
+    created_to: Optional[dt.datetime] = Query(None),
+    expires_from: Optional[dt.datetime] = Query(None),
+    expires_to: Optional[dt.datetime] = Query(None),
+    sort_by: str = Query("created_at", pattern="^(created_at|updated_at|expires_at|key)$"),
+    sort_dir: str = Query("desc", pattern="^(asc|desc)$"),
+):
+    """Xuất toàn bộ license khớp bộ lọc dạng NDJSON (1 dòng JSON / license), không phân trang.
+    Đọc theo lô từ cursor DB -> bộ nhớ không phụ thuộc số dòng."""
+    filters = _license_filters(q, status, plan, created_from, created_to, expires_from, expires_to)
+    order_col = _LICENSE_SORT_COLS[sort_by]
+    order_by = (order_col.desc(), License.id.desc()) if sort_dir == "desc" else (order_col.asc(), License.id.asc())
+    # chọn cột (không phải entity ORM) để session không giữ identity map của mọi dòng
+    stmt = (
+        select(*_LICENSE_ITEM_COLS, func.count(Device.id).label("used"))
+        .outerjoin(Device, Device.license_id == License.id)
+        .group_by(License.id)
+        .order_by(*order_by)
+        .execution_options(yield_per=500)
+    )
+    if filters:
+        stmt = stmt.where(and_(*filters))
+
+    async def gen():
+        # session riêng: sống cùng vòng đời response stream, không phụ thuộc Depends
+        async with AsyncSession(engine) as s:
+            result = await s.stream(stmt)
+            async for row in result:
+                yield orjson.dumps(_license_item(row, row.used)) + b"\n"
 
-    pages = (total + page_size - 1) // page_size
-    return {"items": items, "total": total, "page": page, "page_size": page_size, "pages": pages}
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
 
 
 @app.get("/licenses/{key}", dependencies=[Depends(admin_auth)])
-def get_license_detail(key: str, db: Session = Depends(get_session)):
-    lic = db.exec(select(License).where(License.key == key)).first()
+async def get_license_detail(key: str, db: AsyncSession = Depends(get_session)):
+    # License + activations trong 1 round-trip (JOIN)
+    lic = (await db.exec(
+        select(License).where(License.key == key).options(joinedload(License.activations))
+    )).unique().first()
     if not lic:
         raise HTTPException(404, "Not found")
-    acts = db.exec(
-        select(Activation).where(Activation.license_key == key).order_by(Activation.created_at.desc())
-    ).all()
-    return {"license": lic, "activations": acts}
-
-@app.patch("/licenses/{key}", dependencies=[Depends(admin_auth)])
-def update_license(key: str, data: LicenseUpdate, db: Session = Depends(get_session)):
-    lic = db.exec(select(License).where(License.key == key)).first()
-    if not lic:
+    return {"license": lic, "activations": lic.activations}
+
+# UPDATE thẳng theo key (không SELECT trước); không có dòng nào khớp -> 404
+async def _update_license_or_404(db: AsyncSession, key: str, **values) -> None:
+    stmt = update(License).where(License.key == key).values(updated_at=now_local_naive(), **values)
+    result = await db.exec(stmt)
+    if result.rowcount == 0:
+        await db.rollback()
         raise HTTPException(404, "Not found")
+    await db.commit()
+    _invalidate_license_cache(key)
 
-    for k, v in data.model_dump(exclude_unset=True).items():
-        if k == "expires_days" and v is not None:
-            base = now_local_minute_naive()
-            lic.expires_at = base + dt.timedelta(days=v)
-        elif k != "expires_days":
-            setattr(lic, k, v)
-
-    lic.updated_at = now_local_naive() 
-    db.add(lic); db.commit(); db.refresh(lic)
+@app.patch("/licenses/{key}", dependencies=[Depends(admin_auth)])
+async def update_license(key: str, data: LicenseUpdate, db: AsyncSession = Depends(get_session)):
+    values = data.model_dump(exclude_unset=True)
+    days = values.pop("expires_days", None)
+    if days is not None:
+        values["expires_at"] = now_local_minute_naive() + dt.timedelta(days=days)
+    await _update_license_or_404(db, key, **values)
     return {"ok": True}
 
 @app.delete("/licenses/{key}", dependencies=[Depends(admin_auth)])
-def delete_license(key: str, db: Session = Depends(get_session)):
-    lic = db.exec(select(License).where(License.key == key)).first()
-    if not lic:
-        raise HTTPException(404, "Not found")
-    lic.status = "deleted"
-    db.add(lic); db.commit()
+async def delete_license(key: str, db: AsyncSession = Depends(get_session)):
+    await _update_license_or_404(db, key, status="deleted")
     return {"ok": True}
 
 @app.post("/revoke/{key}", dependencies=[Depends(admin_auth)])
-def revoke(key: str, db: Session = Depends(get_session)):
-    lic = db.exec(select(License).where(License.key == key)).first()
-    if not lic:
-        raise HTTPException(404, "Not found")
-    lic.status = "revoked"
-    db.add(lic); db.commit()
+async def revoke(key: str, db: AsyncSession = Depends(get_session)):
+    await _update_license_or_404(db, key, status="revoked")
     return {"ok": True}
 
+# Bulk: 1 câu UPDATE ... WHERE key IN (...) cho cả lô, trả số dòng bị ảnh hưởng
+async def _bulk_update_licenses(db: AsyncSession, keys: List[str], **values) -> int:
+    stmt = (
+        update(License)
+        .where(License.key.in_(set(keys)))
+        .values(updated_at=now_local_naive(), **values)
+    )
+    result = await db.exec(stmt)
+    await db.commit()
+    _invalidate_license_cache(*keys)
+    return result.rowcount
+
+@app.post("/licenses/bulk-revoke", dependencies=[Depends(admin_auth)])
+async def bulk_revoke(data: LicenseBulkIn, db: AsyncSession = Depends(get_session)):
+    updated = await _bulk_update_licenses(db, data.keys, status="revoked")
+    return {"ok": True, "updated": updated}
+
+@app.post("/licenses/bulk-delete", dependencies=[Depends(admin_auth)])
+async def bulk_delete(data: LicenseBulkIn, db: AsyncSession = Depends(get_session)):
+    updated = await _bulk_update_licenses(db, data.keys, status="deleted")
+    return {"ok": True, "updated": updated}
+
+@app.post("/licenses/bulk-extend", dependencies=[Depends(admin_auth)])
+async def bulk_extend(data: LicenseBulkExtendIn, db: AsyncSession = Depends(get_session)):
+    # giống expires_days của PATCH: hết hạn = bây giờ (làm tròn phút) + N ngày
+    expires_at = now_local_minute_naive() + dt.timedelta(days=data.expires_days)
+    updated = await _bulk_update_licenses(db, data.keys, expires_at=expires_at)
+    return {"ok": True, "updated": updated}
+
+_ACTIVATION_ITEM_COLS = (
+    Activation.id, Activation.license_id, License.key.label("license_key"), Activation.hwid,
+    Activation.created_at, Activation.last_seen_at,
+)
+
 @app.get("/activations", dependencies=[Depends(admin_auth)])
-def list_activations(key: Optional[str] = Query(None), db: Session = Depends(get_session)):
-    stmt = select(Activation)
+async def list_activations(key: Optional[str] = Query(None), db: AsyncSession = Depends(get_session)):
+    # JOIN license để trả kèm license_key như trước (bảng chỉ còn license_id);
+    # chọn cột -> Row thuần, không dựng entity ORM cho từng dòng
+    stmt = select(*_ACTIVATION_ITEM_COLS).join(License, License.id == Activation.license_id)
+    if key:
+        stmt = stmt.where(License.key == key)
+    rows = (await db.exec(stmt.order_by(Activation.created_at.desc()))).all()
+    return OrjsonResponse([dict(r._mapping) for r in rows])
+
+@app.get("/activations/stream", dependencies=[Depends(admin_auth)])
+async def stream_activations(key: Optional[str] = Query(None)):
+    """Như /activations nhưng NDJSON (1 dòng / activation), đọc theo lô từ cursor DB."""
+    stmt = (
+        select(*_ACTIVATION_ITEM_COLS)
+        .join(License, License.id == Activation.license_id)
+        .order_by(Activation.created_at.desc())
+        .execution_options(yield_per=1000)
+    )
     if key:
-        stmt = stmt.where(Activation.license_key == key)
-    return db.exec(stmt.order_by(Activation.created_at.desc())).all()
+        stmt = stmt.where(License.key == key)
+
+    async def gen():
+        async with AsyncSession(engine) as s:
+            result = await s.stream(stmt)
+            async for row in result:
+                yield orjson.dumps(dict(row._mapping)) + b"\n"
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
 
 # ================== Public: Activate / Validate / Deactivate ==================
+_B32_ALPH = "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
+# bảng 1024 cặp ký tự: mỗi lần tra lấy luôn 10 bit -> 2 ký tự
+_B32_PAIRS = [a + b for a in _B32_ALPH for b in _B32_ALPH]
+
 def generate_short_key(prefix: str = "TKT", blocks: int = 4, block_size: int = 4) -> str:
     """Base32 (A-Z, 2-7), bỏ '='. 10 bytes -> 16 ký tự base32 => 4 block x 4"""
-    raw = base64.b32encode(os.urandom(10)).decode().rstrip("=")
-    key_body = "-".join(raw[i:i+block_size] for i in range(0, blocks * block_size, block_size))
+    if blocks == 4 and block_size == 4:
+        # cắt thẳng 80 bit ngẫu nhiên thành 8 cặp ký tự (không qua b32encode/join)
+        r = int.from_bytes(os.urandom(10), "big")
+        p = _B32_PAIRS
+        return "%s-%s%s-%s%s-%s%s-%s%s" % (
+            prefix,
+            p[r >> 70], p[(r >> 60) & 1023], p[(r >> 50) & 1023], p[(r >> 40) & 1023],
+            p[(r >> 30) & 1023], p[(r >> 20) & 1023], p[(r >> 10) & 1023], p[r & 1023],
+        )
+    n = blocks * block_size
+    nbytes = (n * 5 + 7) // 8
+    r = int.from_bytes(os.urandom(nbytes), "big") >> (nbytes * 8 - n * 5)
+    raw = "".join(_B32_ALPH[(r >> (5 * (n - 1 - i))) & 31] for i in range(n))
+    key_body = "-".join(raw[i:i+block_size] for i in range(0, n, block_size))
     return f"{prefix}-{key_body}"
 
 @app.post("/activate")
-def activate(data: ActivateIn, db: Session = Depends(get_session)):
-    lic = db.exec(select(License).where(License.key == data.key)).first()
+async def activate(data: ActivateIn, db: AsyncSession = Depends(get_session)):
+    lic = await _get_license_row(db, data.key)
     if not lic or lic.status != "active":
         raise HTTPException(403, "License invalid")
-    if lic.expires_at and lic.expires_at < now_local_naive():
+    now = now_local_naive()  # 1 lần/request: dùng cho kiểm hạn và created_at
+    if lic.expires_at and lic.expires_at < now:
         raise HTTPException(403, "License expired")
 
-    actives: List[Activation] = db.exec(select(Activation).where(Activation.license_key == lic.key)).all()
-    if not any(a.hwid == data.hwid for a in actives):
-        if len(actives) >= lic.max_devices:
+    # 1 query tổng hợp: số seat đã dùng + hwid này đã kích hoạt chưa (không tải từng dòng)
+    used, have = (await db.exec(_SEL_ACTIVATION_SEATS, params={"lid": lic.id, "h": data.hwid})).one()
+    if not have:
+        if used >= lic.max_devices:
             raise HTTPException(403, f"Seats reached ({lic.max_devices})")
-        db.add(Activation(license_key=lic.key, hwid=data.hwid))
-        db.commit()
+        # 2 request cùng hwid chạy song song: bên chậm hơn rơi vào ON CONFLICT (không lỗi 500)
+        await _insert_ignore(
+            db, Activation.__table__,
+            values={"license_id": lic.id, "hwid": data.hwid, "created_at": now},
+            conflict_cols=["license_id", "hwid"],
+        )
+        await db.commit()
 
     # Token TTL 24h để revoke nhanh
     exp = int(time.time()) + 24 * 3600
     payload = {"k": lic.key, "e": exp, "m": lic.max_devices, "p": lic.plan or "", "kid": KID}
     token = sign_token(PRIV, payload)
-    return {"token": token, "exp": exp, "kid": KID, "plan": lic.plan, "max_devices": lic.max_devices}
+    # hot path public: trả thẳng orjson, bỏ qua jsonable_encoder
+    return OrjsonResponse({"token": token, "exp": exp, "kid": KID, "plan": lic.plan, "max_devices": lic.max_devices})
 
 @app.post("/validate")
-def validate_token(data: ValidateIn, db: Session = Depends(get_session)):
+async def validate_token(data: ValidateIn, db: AsyncSession = Depends(get_session)):
     try:
-        payload = verify_token(PUB_PEM, data.token)
+        payload = _verify_token_cached(data.token)
     except Exception:
         raise HTTPException(401, "Invalid token")
 
-    lic = db.exec(select(License).where(License.key == payload["k"])).first()
-    if not lic or lic.status != "active":
+    # License + activation của hwid trong 1 round-trip (LEFT JOIN)
+    row = (await db.exec(_SEL_VALIDATE, params={"k": payload["k"], "h": data.hwid})).first()
+    if not row or row.status != "active":
         raise HTTPException(403, "License invalid")
-
-    act = db.exec(
-        select(Activation).where(Activation.license_key == lic.key, Activation.hwid == data.hwid)
-    ).first()
-    if not act:
+    if row.act_id is None:
         raise HTTPException(403, "Device not activated")
 
-    act.last_seen_at = now_local_naive()
-    db.add(act); db.commit()
+    _LAST_SEEN[row.act_id] = now_local_naive()
 
-    return {"ok": True, "plan": lic.plan, "max_devices": lic.max_devices, "kid": payload.get("kid")}
+    return OrjsonResponse({"ok": True, "plan": row.plan, "max_devices": row.max_devices, "kid": payload.get("kid")})
 
 @app.post("/deactivate")
-def deactivate(data: DeactivateIn, db: Session = Depends(get_session)):
-    act = db.exec(
-        select(Activation).where(Activation.license_key == data.key, Activation.hwid == data.hwid)
-    ).first()
-    if not act:
+async def deactivate(data: DeactivateIn, db: AsyncSession = Depends(get_session)):
+    # DELETE thẳng theo (license_id, hwid): không SELECT cả dòng chỉ để xoá
+    res = await db.exec(_DEL_ACTIVATION, params={"k": data.key, "h": data.hwid})
+    if res.rowcount == 0:
         raise HTTPException(404, "Activation not found")
-    db.delete(act); db.commit()
+    await db.commit()
     return {"ok": True}
 
 class LicenseLookupIn(BaseModel):
@@ -727,150 +1220,107 @@ class LicenseLookupIn(BaseModel):
     app_ver: Optional[str] = None
 
 @app.post("/license/lookup")
-def license_lookup(data: LicenseLookupIn, db: Session = Depends(get_session)):
-    lic = db.exec(select(License).where(License.key == data.key)).first()
-    if not lic:
-        raise HTTPException(404, "Not found")
-    if lic.status != "active":
-        raise HTTPException(403, "License invalid")
-    return _public_license_dict(lic, db, data.app_ver)
+async def license_lookup(data: LicenseLookupIn, db: AsyncSession = Depends(get_session)):
+    lic, used = await _get_active_license_with_used(db, data.key)
+    # dict chỉ gồm str/int/bool -> orjson thẳng, bỏ qua jsonable_encoder
+    return OrjsonResponse(_public_license_dict(lic, used, data.app_ver))
 
 @app.get("/licenses/{key}/public")
-def get_license_public(key: str, app_ver: Optional[str] = None, db: Session = Depends(get_session)):
-    lic = db.exec(select(License).where(License.key == key)).first()
-    if not lic:
-        raise HTTPException(404, "Not found")
-    if lic.status != "active":
-        raise HTTPException(403, "License invalid")
-    return _public_license_dict(lic, db, app_ver)
+async def get_license_public(key: str, app_ver: Optional[str] = None, db: AsyncSession = Depends(get_session)):
+    lic, used = await _get_active_license_with_used(db, key)
+    return OrjsonResponse(_public_license_dict(lic, used, app_ver))
 
 @app.post("/devices/register")
-def register_device(data: DeviceRegisterIn, db: Session = Depends(get_session)):
+async def register_device(data: DeviceRegisterIn, db: AsyncSession = Depends(get_session)):
     # Tìm license
-    lic = db.exec(select(License).where(License.key == data.key)).first()
+    lic = await _get_license_row(db, data.key)
     if not lic or lic.status != "active":
         raise HTTPException(403, "License invalid")
-    if lic.expires_at and lic.expires_at < now_local_naive():
+    now = now_local_naive()  # 1 lần/request: kiểm hạn + created_at/last_seen_at
+    if lic.expires_at and lic.expires_at < now:
         raise HTTPException(403, "License expired")
 
-    # Upsert theo (license_id, hwid)
-    dev = db.exec(
-        select(Device).where(Device.license_id == lic.id, Device.hwid == data.hwid)
-    ).first()
-
-    if not dev:
-        # kiểm tra seats
-        used = scalar_int(db, select(func.count(Device.id)).where(Device.license_id == lic.id))
-        if used >= lic.max_devices:
-            raise HTTPException(403, f"Seats reached ({lic.max_devices})")
-
-        dev = Device(
-            license_id=lic.id,
-            hwid=data.hwid,
-            hostname=data.hostname,
-            platform=data.platform,
-            app_ver=data.app_ver,
-        )
-        db.add(dev)
-        db.commit()
-        db.refresh(dev)
-    else:
-        # update thông tin + last_seen
-        changed = False
-        if data.hostname and data.hostname != dev.hostname:
-            dev.hostname = data.hostname; changed = True
-        if data.platform and data.platform != dev.platform:
-            dev.platform = data.platform; changed = True
-        if data.app_ver and data.app_ver != dev.app_ver:
-            dev.app_ver = data.app_ver; changed = True
-        dev.last_seen_at = now_local_naive(); changed = True
-        if changed:
-            db.add(dev); db.commit(); db.refresh(dev)
-
-    used_after = scalar_int(db, select(func.count(Device.id)).where(Device.license_id == lic.id))
+    # Seat đã dùng + hwid này đã đăng ký chưa: 1 query tổng hợp
+    used, have = (await db.exec(_SEL_DEVICE_SEATS, params={"lid": lic.id, "h": data.hwid})).one()
+    if not have and used >= lic.max_devices:
+        raise HTTPException(403, f"Seats reached ({lic.max_devices})")
+
+    # Upsert theo (license_id, hwid): máy mới -> INSERT, máy cũ -> cập nhật thông tin + last_seen
+    changes = {"last_seen_at": now}
+    if data.hostname:
+        changes["hostname"] = data.hostname
+    if data.platform:
+        changes["platform"] = data.platform
+    if data.app_ver:
+        changes["app_ver"] = data.app_ver
+    device_id = await _upsert_returning_id(
+        db, Device.__table__,
+        values={
+            "license_id": lic.id,
+            "hwid": data.hwid,
+            "hostname": data.hostname,
+            "platform": data.platform,
+            "app_ver": data.app_ver,
+            "created_at": now,
+        },
+        conflict_cols=["license_id", "hwid"],
+        update=changes,
+    )
+    await db.commit()
+    if not have:
+        _invalidate_license_cache(lic.key)
+    used_after = (await db.exec(_SEL_DEVICE_COUNT, params={"lid": lic.id})).one()
 
-    return {
+    return OrjsonResponse({
         "ok": True,
         "license_key": lic.key,
-        "device_id": dev.id,
+        "device_id": device_id,
         "used_devices": used_after,
         "max_devices": lic.max_devices,
-    }
+    })
 # ================== Download Redirect ==================
 
-@app.get("/download", response_class=HTMLResponse)
-def download_page():
-    latest_url = _gh_latest_asset_url(GITHUB_OWNER, GITHUB_REPO, GITHUB_ASSET)
-    return f"""<!doctype html>
+# Trang tải chỉ phụ thuộc env GITHUB_* -> dựng sẵn lúc import như trang chủ
+_DOWNLOAD_HTML = f"""<!doctype html>
 <html><head><meta charset="utf-8"><title>Tải xuống</title></head>
 <body style="font-family:system-ui; max-width:720px; margin:40px auto; line-height:1.6">
   <h1>⬇ Tải phần mềm</h1>
   <ul>
     <li><a href="/download/myapp">Tải bản mới nhất (.exe)</a></li>
-    <li>Hoặc trỏ thẳng GitHub: <code>{latest_url}</code></li>
+    <li>Hoặc trỏ thẳng GitHub: <code>{GITHUB_LATEST_URL}</code></li>
   </ul>
   <p>Mẹo: Nếu trình duyệt cảnh báo, hãy chọn “Giữ lại” (Keep) hoặc đóng gói .zip khi phát hành.</p>
-</body></html>"""
+</body></html>""".encode("utf-8")
+_DOWNLOAD_ETAG = _etag(_DOWNLOAD_HTML)
+
+@app.get("/download", response_class=HTMLResponse)
+async def download_page(request: Request):
+    return _static_response(request, _DOWNLOAD_HTML, _DOWNLOAD_ETAG, "text/html", 300)
 
 @app.get("/download/myapp")
-def download_latest(request: Request, db: Session = Depends(get_session)):
+async def download_latest(request: Request):
     """
     Redirect 302 tới asset mới nhất: https://github.com/<owner>/<repo>/releases/latest/download/<asset>
     """
-    url = _gh_latest_asset_url(GITHUB_OWNER, GITHUB_REPO, GITHUB_ASSET)
-
-    # ghi log
-    try:
-        db.add(DownloadLog(
-            path="/download/myapp",
-            ua=request.headers.get("User-Agent"),
-            ip=_client_ip(request),
-            ref=request.headers.get("Referer"),
-        ))
-        db.commit()
-    except Exception:
-        db.rollback()
-        # không chặn tải nếu ghi log lỗi
-
-    return RedirectResponse(url, status_code=302)
+    # giữ 302 (không 308): redirect bị cache ở trình duyệt/CDN sẽ không còn được log
+    _log_download(request, "/download/myapp")
+    return RedirectResponse(GITHUB_LATEST_URL, status_code=302)
 
 @app.get("/download/{tag}")
-def download_by_tag(tag: str, request: Request, db: Session = Depends(get_session)):
+async def download_by_tag(tag: str, request: Request):
     """
     Redirect 302 tới asset ở một phiên bản cụ thể (ví dụ tag=v1.2.3)
     """
     url = _gh_tag_asset_url(GITHUB_OWNER, GITHUB_REPO, tag, GITHUB_ASSET)
-
-    try:
-        db.add(DownloadLog(
-            path=f"/download/{tag}",
-            ua=request.headers.get("User-Agent"),
-            ip=_client_ip(request),
-            ref=request.headers.get("Referer"),
-        ))
-        db.commit()
-    except Exception:
-        db.rollback()
-
+    _log_download(request, f"/download/{tag}")
     return RedirectResponse(url, status_code=302)
 
 @app.get("/download/{tag}/{asset}")
-def download_by_tag_asset(tag: str, asset: str, request: Request, db: Session = Depends(get_session)):
+async def download_by_tag_asset(tag: str, asset: str, request: Request):
     """
     Trường hợp bạn có nhiều file trong một release (VD: .exe, .zip),
     cho phép chỉ định tên asset khác GITHUB_ASSET.
     """
     url = _gh_tag_asset_url(GITHUB_OWNER, GITHUB_REPO, tag, asset)
-
-    try:
-        db.add(DownloadLog(
-            path=f"/download/{tag}/{asset}",
-            ua=request.headers.get("User-Agent"),
-            ip=_client_ip(request),
-            ref=request.headers.get("Referer"),
-        ))
-        db.commit()
-    except Exception:
-        db.rollback()
-
+    _log_download(request, f"/download/{tag}/{asset}")
     return RedirectResponse(url, status_code=302)
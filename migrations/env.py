@@ -16,7 +16,7 @@ import sys
 from logging.config import fileConfig
 
 from alembic import context
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 from sqlmodel import SQLModel
 
 # -------------------------------------------------------------------
@@ -29,18 +29,18 @@ if config.config_file_name is not None:
 # -------------------------------------------------------------------
 # 1) Đảm bảo có thể import module dự án để metadata chứa đầy đủ bảng
 #    - Thêm project root vào sys.path
-#    - Import "app" (hoặc models) để register các model với SQLModel.metadata
-#    Lưu ý: nếu import app.py có side-effect, cân nhắc tách models vào models.py
+#    - Import "models" để register các model với SQLModel.metadata
 # -------------------------------------------------------------------
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
-# Thử import app hoặc models để các class (License, Device, ...) được load
+# Import models để các class (License, Device, ...) được load; chỉ khai báo bảng,
+# không kéo theo FastAPI/sqladmin như import app
 try:
-    import app  # noqa: F401  # nếu models ở app.py, import app là đủ
+    import models  # noqa: F401
 except Exception as e:
-    print("[alembic/env.py] Warning: cannot import app to load models:", e)
+    print("[alembic/env.py] Warning: cannot import models:", e)
 
 # -------------------------------------------------------------------
 # 2) Chỉ ra metadata để Alembic autogenerate dựa vào đó
@@ -115,8 +115,18 @@ def run_migrations_online():
             include_object=include_object,
             render_as_batch=url.startswith("sqlite"),
         )
+        # DB trống: chuỗi migration giả định bảng license đã có (init_schema rỗng)
+        # -> tạo thẳng schema hiện tại từ models rồi stamp head
+        fresh = not inspect(connection).has_table("license")
         with context.begin_transaction():
-            context.run_migrations()
+            if fresh:
+                target_metadata.create_all(connection)
+                context.get_context().stamp(context.script, "head")
+            else:
+                context.run_migrations()
+        if fresh:
+            # DDL không transaction (SQLite/MySQL): dòng alembic_version vẫn cần commit
+            connection.commit()
 
 # -------------------------------------------------------------------
 # 8) Nhánh điều khiển offline/online
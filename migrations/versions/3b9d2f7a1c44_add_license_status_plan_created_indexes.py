@@ -0,0 +1,50 @@
+"""add license (status, created_at) / (plan, created_at) indexes
+
+Revision ID: 3b9d2f7a1c44
+Revises: 667e32b62960
+Create Date: 2026-10-15 11:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+# revision identifiers, used by Alembic.
+revision: str = "3b9d2f7a1c44"
+down_revision: Union[str, Sequence[str], None] = "667e32b62960"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# ---------- helpers (idempotent) ----------
+def _has_index(table: str, name: str) -> bool:
+    return any(ix["name"] == name for ix in inspect(op.get_bind()).get_indexes(table))
+
+
+def _create_index(name: str, table: str, cols: list) -> None:
+    # MySQL: dựng index online (INPLACE, không khoá ghi)
+    if op.get_bind().dialect.name == "mysql":
+        op.execute(
+            f"CREATE INDEX `{name}` ON `{table}` ({', '.join(f'`{c}`' for c in cols)}) "
+            "ALGORITHM=INPLACE LOCK=NONE"
+        )
+    else:
+        op.create_index(name, table, cols, unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # list_licenses: lọc status hoặc plan rồi ORDER BY created_at
+    if not _has_index("license", "ix_license_status_created"):
+        _create_index("ix_license_status_created", "license", ["status", "created_at"])
+    if not _has_index("license", "ix_license_plan_created"):
+        _create_index("ix_license_plan_created", "license", ["plan", "created_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if _has_index("license", "ix_license_plan_created"):
+        op.drop_index("ix_license_plan_created", table_name="license")
+    if _has_index("license", "ix_license_status_created"):
+        op.drop_index("ix_license_status_created", table_name="license")
@@ -0,0 +1,43 @@
+"""add covering index on license.key (postgres only)
+
+Revision ID: 5d7e9a3b2f16
+Revises: 8e41c0d5a7b2
+Create Date: 2026-10-15 13:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+# revision identifiers, used by Alembic.
+revision: str = "5d7e9a3b2f16"
+down_revision: Union[str, Sequence[str], None] = "8e41c0d5a7b2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_INCLUDE = ["id", "status", "plan", "max_devices", "max_version", "expires_at"]
+
+
+# ---------- helpers (idempotent) ----------
+def _has_index(table: str, name: str) -> bool:
+    return any(ix["name"] == name for ix in inspect(op.get_bind()).get_indexes(table))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # INCLUDE chỉ có trên Postgres; SQLite/MySQL đã có index unique trên key
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    if not _has_index("license", "ix_license_key_covering"):
+        op.create_index(
+            "ix_license_key_covering", "license", ["key"], unique=False, postgresql_include=_INCLUDE
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    if _has_index("license", "ix_license_key_covering"):
+        op.drop_index("ix_license_key_covering", table_name="license")
@@ -0,0 +1,52 @@
+"""add activation (license_key, created_at) index
+
+Revision ID: 667e32b62960
+Revises: faa8ebd2cad8
+Create Date: 2026-10-15 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+# revision identifiers, used by Alembic.
+revision: str = "667e32b62960"
+down_revision: Union[str, Sequence[str], None] = "faa8ebd2cad8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# ---------- helpers (idempotent) ----------
+def _has_index(table: str, name: str) -> bool:
+    return any(ix["name"] == name for ix in inspect(op.get_bind()).get_indexes(table))
+
+
+def _create_index(name: str, table: str, cols: list) -> None:
+    # MySQL: dựng index online (INPLACE, không khoá ghi)
+    if op.get_bind().dialect.name == "mysql":
+        op.execute(
+            f"CREATE INDEX `{name}` ON `{table}` ({', '.join(f'`{c}`' for c in cols)}) "
+            "ALGORITHM=INPLACE LOCK=NONE"
+        )
+    else:
+        op.create_index(name, table, cols, unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # lọc theo license_key + ORDER BY created_at DESC trong 1 lần quét index
+    if not _has_index("activation", "ix_activation_license_created"):
+        _create_index("ix_activation_license_created", "activation", ["license_key", "created_at"])
+
+    # index đơn trên license_key đã nằm trong tiền tố của index mới -> bỏ
+    if _has_index("activation", "ix_activation_license_key"):
+        op.drop_index("ix_activation_license_key", table_name="activation")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_index("activation", "ix_activation_license_key"):
+        op.create_index("ix_activation_license_key", "activation", ["license_key"], unique=False)
+    if _has_index("activation", "ix_activation_license_created"):
+        op.drop_index("ix_activation_license_created", table_name="activation")
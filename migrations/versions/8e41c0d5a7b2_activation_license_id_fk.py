@@ -0,0 +1,93 @@
+"""activation: license_key -> license_id FK
+
+Revision ID: 8e41c0d5a7b2
+Revises: 3b9d2f7a1c44
+Create Date: 2026-10-15 12:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+# revision identifiers, used by Alembic.
+revision: str = "8e41c0d5a7b2"
+down_revision: Union[str, Sequence[str], None] = "3b9d2f7a1c44"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# ---------- helpers (idempotent) ----------
+def _has_index(table: str, name: str) -> bool:
+    return any(ix["name"] == name for ix in inspect(op.get_bind()).get_indexes(table))
+
+
+def _has_column(table: str, name: str) -> bool:
+    return any(c["name"] == name for c in inspect(op.get_bind()).get_columns(table))
+
+
+def _unique_names(table: str) -> list:
+    return [uc["name"] for uc in inspect(op.get_bind()).get_unique_constraints(table) if uc["name"]]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if _has_column("activation", "license_id"):
+        return
+
+    # 1) thêm cột (tạm cho NULL) rồi backfill từ license.key
+    op.add_column("activation", sa.Column("license_id", sa.Integer(), nullable=True))
+    op.execute(
+        "UPDATE activation SET license_id = "
+        "(SELECT license.id FROM license WHERE license.key = activation.license_key)"
+    )
+    # activation trỏ tới key không còn tồn tại -> không map được sang id, bỏ
+    op.execute("DELETE FROM activation WHERE license_id IS NULL")
+
+    # 2) bỏ index/unique cũ theo license_key
+    if _has_index("activation", "ix_activation_license_created"):
+        op.drop_index("ix_activation_license_created", table_name="activation")
+    if _has_index("activation", "ix_activation_license_key"):
+        op.drop_index("ix_activation_license_key", table_name="activation")
+    uniques = _unique_names("activation")
+
+    # 3) NOT NULL + FK + unique mới, bỏ license_key (SQLite: batch recreate bảng)
+    with op.batch_alter_table("activation") as batch:
+        if "uq_activation_license_hwid" in uniques:
+            batch.drop_constraint("uq_activation_license_hwid", type_="unique")
+        batch.alter_column("license_id", existing_type=sa.Integer(), nullable=False)
+        batch.create_foreign_key(
+            "fk_activation_license_id", "license", ["license_id"], ["id"], ondelete="CASCADE"
+        )
+        batch.create_unique_constraint("uq_activation_license_hwid", ["license_id", "hwid"])
+        batch.drop_column("license_key")
+
+    op.create_index(
+        "ix_activation_license_created", "activation", ["license_id", "created_at"], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_column("activation", "license_id"):
+        return
+
+    op.add_column("activation", sa.Column("license_key", sa.String(length=64), nullable=True))
+    op.execute(
+        "UPDATE activation SET license_key = "
+        "(SELECT license.key FROM license WHERE license.id = activation.license_id)"
+    )
+
+    if _has_index("activation", "ix_activation_license_created"):
+        op.drop_index("ix_activation_license_created", table_name="activation")
+
+    with op.batch_alter_table("activation") as batch:
+        batch.drop_constraint("uq_activation_license_hwid", type_="unique")
+        batch.drop_constraint("fk_activation_license_id", type_="foreignkey")
+        batch.alter_column("license_key", existing_type=sa.String(length=64), nullable=False)
+        batch.create_unique_constraint("uq_activation_license_hwid", ["license_key", "hwid"])
+        batch.drop_column("license_id")
+
+    op.create_index(
+        "ix_activation_license_created", "activation", ["license_key", "created_at"], unique=False
+    )
@@ -4,6 +4,7 @@ Revision ID: 92c6d9b78485
 Revises: bfbe0f25fa33
 Create Date: 2025-09-12 09:34:25.857572
 """
+import time
 from typing import Sequence, Union
 
 from alembic import op
@@ -31,24 +32,76 @@ def _has_index(table: str, name: str) -> bool:
 def _dialect() -> str:
     return op.get_bind().dialect.name  # 'mysql', 'postgresql', 'sqlite', ...
 
+def _status_is_enum() -> bool:
+    col = next(c for c in _insp().get_columns("license") if c["name"] == "status")
+    return isinstance(col["type"], sa.Enum)
+
+
+# ---------- MySQL: ENUM -> VARCHAR không rewrite cả bảng dưới khoá ----------
+_BACKFILL_BATCH = 10_000
+_STATUS_TRIGGERS = ("trg_license_status_new_ins", "trg_license_status_new_upd")
+
+def _swap_status_to_varchar() -> None:
+    """Thêm status_new, trigger giữ đồng bộ với ghi mới, backfill theo lô id,
+    rồi tráo cột trong 1 LOCK TABLES ngắn."""
+    bind = op.get_bind()
+    if not _has_column("license", "status_new"):  # lần chạy trước có thể dừng giữa chừng
+        op.execute("ALTER TABLE `license` ADD COLUMN `status_new` VARCHAR(16) NOT NULL DEFAULT 'active'")
+
+    # INSERT/UPDATE trong lúc backfill -> trigger chép status sang status_new
+    for name in _STATUS_TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS `{name}`")
+    op.execute(
+        "CREATE TRIGGER `trg_license_status_new_ins` BEFORE INSERT ON `license` "
+        "FOR EACH ROW SET NEW.`status_new` = NEW.`status`"
+    )
+    op.execute(
+        "CREATE TRIGGER `trg_license_status_new_upd` BEFORE UPDATE ON `license` "
+        "FOR EACH ROW SET NEW.`status_new` = NEW.`status`"
+    )
+
+    lo, hi = bind.execute(sa.text("SELECT MIN(id), MAX(id) FROM `license`")).one()
+    if lo is not None:
+        upd = sa.text("UPDATE `license` SET `status_new` = `status` WHERE id BETWEEN :a AND :b")
+        for a in range(lo, hi + 1, _BACKFILL_BATCH):
+            bind.execute(upd, {"a": a, "b": a + _BACKFILL_BATCH - 1})
+            time.sleep(0.05)  # nhường replica bắt kịp
+
+    # bỏ trigger + tráo cột trong cùng 1 khoá ghi -> không dòng nào lọt giữa 2 bước;
+    # tráo bằng 1 câu ALTER (ALTER thứ 2 dưới LOCK TABLES có thể mất khoá)
+    op.execute("LOCK TABLES `license` WRITE")
+    try:
+        for name in _STATUS_TRIGGERS:
+            op.execute(f"DROP TRIGGER `{name}`")
+        op.execute(
+            "ALTER TABLE `license` DROP COLUMN `status`, "
+            "CHANGE COLUMN `status_new` `status` VARCHAR(16) NOT NULL"
+        )
+    finally:
+        op.execute("UNLOCK TABLES")
+
 
 def upgrade() -> None:
     """Upgrade schema."""
 
     # 1) Đổi kiểu status: ENUM('active','revoked','deleted') -> VARCHAR(16)
-    #    Bọc try/except để nếu đã đổi trước đó thì bỏ qua.
-    try:
-        op.alter_column(
-            "license",
-            "status",
-            existing_type=mysql.ENUM("active", "revoked", "deleted"),
-            type_=sa.String(length=16),
-            existing_nullable=False,
-            server_default=None,
-        )
-    except Exception:
-        # Có thể đã là VARCHAR sẵn, bỏ qua
-        pass
+    if _dialect() == "mysql" and _status_is_enum():
+        # MODIFY đổi kiểu = copy cả bảng, chặn ghi suốt lúc copy -> thêm cột / backfill / tráo
+        _swap_status_to_varchar()
+    else:
+        # Bọc try/except để nếu đã đổi trước đó thì bỏ qua.
+        try:
+            op.alter_column(
+                "license",
+                "status",
+                existing_type=mysql.ENUM("active", "revoked", "deleted"),
+                type_=sa.String(length=16),
+                existing_nullable=False,
+                server_default=None,
+            )
+        except Exception:
+            # Có thể đã là VARCHAR sẵn, bỏ qua
+            pass
 
     # 2) Thêm các cột mới (chỉ thêm nếu chưa tồn tại)
     if not _has_column("license", "license"):
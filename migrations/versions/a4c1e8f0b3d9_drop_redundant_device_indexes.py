@@ -0,0 +1,40 @@
+"""drop redundant device indexes
+
+Revision ID: a4c1e8f0b3d9
+Revises: 5d7e9a3b2f16
+Create Date: 2026-10-15 14:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+# revision identifiers, used by Alembic.
+revision: str = "a4c1e8f0b3d9"
+down_revision: Union[str, Sequence[str], None] = "5d7e9a3b2f16"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# ---------- helpers (idempotent) ----------
+def _has_index(table: str, name: str) -> bool:
+    return any(ix["name"] == name for ix in inspect(op.get_bind()).get_indexes(table))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # uq_device_license_hwid (license_id, hwid) đã phủ lookup theo license_id (cột trái nhất)
+    if _has_index("device", "ix_device_license_id"):
+        op.drop_index("ix_device_license_id", table_name="device")
+    # không có truy vấn nào lọc riêng theo hwid
+    if _has_index("device", "ix_device_hwid"):
+        op.drop_index("ix_device_hwid", table_name="device")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_index("device", "ix_device_hwid"):
+        op.create_index("ix_device_hwid", "device", ["hwid"], unique=False)
+    if not _has_index("device", "ix_device_license_id"):
+        op.create_index("ix_device_license_id", "device", ["license_id"], unique=False)
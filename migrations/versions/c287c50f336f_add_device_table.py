@@ -8,6 +8,7 @@ from typing import Sequence, Union
 
 from alembic import op
 import sqlalchemy as sa
+from sqlalchemy import inspect
 
 # revision identifiers, used by Alembic.
 revision: str = "c287c50f336f"
@@ -17,6 +18,10 @@ depends_on: Union[str, Sequence[str], None] = None
 
 
 def upgrade() -> None:
+    # DB dựng bằng create_all lúc startup đã có sẵn bảng device -> bỏ qua
+    if inspect(op.get_bind()).has_table("device"):
+        return
+
     # Tạo bảng device
     op.create_table(
         "device",
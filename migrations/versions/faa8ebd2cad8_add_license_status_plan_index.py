@@ -0,0 +1,49 @@
+"""add license (status, plan) index
+
+Revision ID: faa8ebd2cad8
+Revises: c287c50f336f
+Create Date: 2026-10-15 09:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+# revision identifiers, used by Alembic.
+revision: str = "faa8ebd2cad8"
+down_revision: Union[str, Sequence[str], None] = "c287c50f336f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# ---------- helpers (idempotent) ----------
+def _has_index(table: str, name: str) -> bool:
+    return any(ix["name"] == name for ix in inspect(op.get_bind()).get_indexes(table))
+
+
+def _create_index(name: str, table: str, cols: list) -> None:
+    # MySQL: dựng index online (INPLACE, không khoá ghi)
+    if op.get_bind().dialect.name == "mysql":
+        op.execute(
+            f"CREATE INDEX `{name}` ON `{table}` ({', '.join(f'`{c}`' for c in cols)}) "
+            "ALGORITHM=INPLACE LOCK=NONE"
+        )
+    else:
+        op.create_index(name, table, cols, unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # list_licenses lọc theo status/plan
+    if not _has_index("license", "ix_license_status_plan"):
+        _create_index("ix_license_status_plan", "license", ["status", "plan"])
+
+    # (license_id, hwid) của device và (license_key, hwid) của activation đã có
+    # unique constraint phủ sẵn -> không tạo thêm index trùng
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if _has_index("license", "ix_license_status_plan"):
+        op.drop_index("ix_license_status_plan", table_name="license")
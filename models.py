@@ -1,38 +1,86 @@
-from typing import Optional
-from sqlmodel import SQLModel, Field, Session, create_engine, select
-from sqlalchemy import UniqueConstraint, CheckConstraint
-import datetime
-from sqlalchemy import func
+# models.py
+# Các bảng SQLModel. Tách khỏi app.py để Alembic (migrations/env.py) chỉ cần import
+# module này, không kéo theo FastAPI/sqladmin/route.
+import datetime as dt
+from typing import Optional, List
+
+from sqlalchemy import UniqueConstraint, CheckConstraint, Column, Text, Index
+from sqlmodel import SQLModel, Field, Relationship
+
+from utilities.tkt_time import now_local_naive
+
 
 class License(SQLModel, table=True):
-    # Bảng license
     id: Optional[int] = Field(default=None, primary_key=True)
-    key: str = Field(index=True, unique=True, nullable=False)     # key ngắn (TKT-XXXX-XXXX)
-    license: Optional[str] = None                                 # (tuỳ chọn) lưu chuỗi license đầy đủ nếu cần
-    plan: Optional[str] = None
-    expires_at: Optional[datetime.datetime] = None                # ngày hết hạn (UTC)
-    max_version: str = Field(default="0.0.1")                     # phiên bản tối đa
-    max_devices: int = Field(default=1)                           # số thiết bị tối đa
-    status: str = Field(default="active")                         # active|revoked|deleted
-    notes: Optional[str] = None
-    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow, index=True)
-    updated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow, index=True)
+    key: str = Field(index=True, unique=True, nullable=False, max_length=64)
+    license: Optional[str] = Field(default=None, sa_column=Column(Text))
+    status: str = Field(default="active", max_length=16)
+    plan: Optional[str] = Field(default=None, max_length=32)
+    max_version: str = Field(default="0.0.1", max_length=50)
+    max_devices: int = Field(default=1)
+    expires_at: Optional[dt.datetime] = Field(default=None)
+    notes: Optional[str] = Field(default=None)
+    created_at: dt.datetime = Field(default_factory=now_local_naive)
+    updated_at: dt.datetime = Field(default_factory=now_local_naive)
+
+    # Activation nối theo FK license_id -> chỉ đọc, mới nhất trước
+    activations: List["Activation"] = Relationship(
+        sa_relationship_kwargs={
+            "order_by": "Activation.created_at.desc()",
+            "viewonly": True,
+        }
+    )
 
     __table_args__ = (
         CheckConstraint("status in ('active','revoked','deleted')", name="ck_license_status"),
+        Index("ix_license_created_at", "created_at"),
+        Index("ix_license_updated_at", "updated_at"),
+        # lọc status/plan của list_licenses
+        Index("ix_license_status_plan", "status", "plan"),
+        # lọc status hoặc plan + ORDER BY created_at (mặc định) -> quét range index, khỏi sort
+        Index("ix_license_status_created", "status", "created_at"),
+        Index("ix_license_plan_created", "plan", "created_at"),
+        # Postgres: lookup theo key của /activate, /validate, /license/lookup chỉ cần đọc index
+        # (bỏ cột license TEXT lớn); dialect khác không có INCLUDE -> không tạo
+        Index(
+            "ix_license_key_covering", "key",
+            postgresql_include=["id", "status", "plan", "max_devices", "max_version", "expires_at"],
+        ).ddl_if(dialect="postgresql"),
     )
 
 class Device(SQLModel, table=True):
     # Bảng quản lý máy sử dụng license
     id: Optional[int] = Field(default=None, primary_key=True)
-    license_id: int = Field(index=True, foreign_key="license.id") # tham chiếu license
-    hwid: str = Field(index=True)                                 # mã phần cứng duy nhất
-    hostname: Optional[str] = None                                # tên máy (tuỳ chọn)
-    platform: Optional[str] = None                                # Windows/Linux/Mac...
-    app_ver: Optional[str] = None                                 # version app khi activate
-    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow, index=True)
-    last_seen_at: Optional[datetime.datetime] = None
+    # lookup theo license_id dùng cột trái nhất của uq_device_license_hwid
+    license_id: int = Field(foreign_key="license.id")
+    hwid: str
+    hostname: Optional[str] = None
+    platform: Optional[str] = None
+    app_ver: Optional[str] = None
+    created_at: dt.datetime = Field(default_factory=now_local_naive, index=True)
+    last_seen_at: Optional[dt.datetime] = None
 
     __table_args__ = (
         UniqueConstraint("license_id", "hwid", name="uq_device_license_hwid"),
     )
+
+class Activation(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    license_id: int = Field(foreign_key="license.id", ondelete="CASCADE")
+    hwid: str = Field(max_length=255)
+    created_at: dt.datetime = Field(default_factory=now_local_naive)
+    last_seen_at: Optional[dt.datetime] = None
+
+    __table_args__ = (
+        UniqueConstraint("license_id", "hwid", name="uq_activation_license_hwid"),
+        Index("ix_activation_created_at", "created_at"),
+        # /activations?key=... và chi tiết license: lọc license_id, sắp xếp created_at
+        Index("ix_activation_license_created", "license_id", "created_at"),
+    )
+class DownloadLog(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(index=True, max_length=255)
+    ua: Optional[str] = Field(default=None)
+    ip: Optional[str] = Field(default=None)
+    ref: Optional[str] = Field(default=None)
+    created_at: dt.datetime = Field(default_factory=now_local_naive, index=True)
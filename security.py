@@ -1,17 +1,32 @@
 # security.py
-import os, base64, hashlib, textwrap, time, msgpack
+import os, re, base64, binascii, hashlib, textwrap, time, msgpack
+from functools import lru_cache
 from typing import Dict, Any, Tuple
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
 from cryptography.hazmat.primitives import serialization
+try:
+    # libsodium qua PyNaCl: sign/verify Ed25519 nhanh ~2x so với binding OpenSSL; không có thì dùng cryptography
+    from nacl.signing import SigningKey as _NaclSigningKey, VerifyKey as _NaclVerifyKey
+except ImportError:
+    _NaclSigningKey = _NaclVerifyKey = None
 
 # ===== helpers =====
-b64u = lambda b: base64.urlsafe_b64encode(b).rstrip(b"=").decode("ascii")
+def b64u(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode("ascii")
+
+_B64U_TO_STD = bytes.maketrans(b"-_", b"+/")
+
 def b64u_d(s: str) -> bytes:
-    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+    # binascii trực tiếp: bỏ lớp urlsafe_b64decode (translate + str concat); "==" thừa được bỏ qua
+    return binascii.a2b_base64(s.encode("ascii").translate(_B64U_TO_STD) + b"==")
+
+_PEM_NL_RE = re.compile(r"\\n|\r\n")
 
 def _normalize_pem(s: str) -> str:
-    # cho phép dán chuỗi có "\n" literal, chuẩn hoá CRLF -> LF, bỏ khoảng trắng thừa
-    return s.replace("\\n", "\n").replace("\r\n", "\n").strip()
+    # cho phép dán chuỗi có "\n" literal, chuẩn hoá CRLF -> LF, bỏ khoảng trắng thừa (1 lượt quét)
+    if "\\n" not in s and "\r" not in s:
+        return s.strip()
+    return _PEM_NL_RE.sub("\n", s).strip()
 
 def _load_pems(priv_pem: str, pub_pem: str) -> Tuple[Ed25519PrivateKey, bytes]:
     priv = serialization.load_pem_private_key(priv_pem.encode(), password=None)
@@ -23,16 +38,25 @@ def _load_pems(priv_pem: str, pub_pem: str) -> Tuple[Ed25519PrivateKey, bytes]:
 # ===== key loading (Cách 1 ưu tiên Secret Files) =====
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+def _list_dir(path: str) -> frozenset:
+    # 1 syscall liệt kê thư mục thay cho os.path.exists từng file; không có thư mục -> rỗng
+    try:
+        return frozenset(os.listdir(path))
+    except OSError:
+        return frozenset()
+
+def _read_pair(d: str, priv_name: str, pub_name: str) -> Tuple[str, str]:
+    with open(os.path.join(d, priv_name), "r", encoding="utf-8") as f: priv_pem = f.read()
+    with open(os.path.join(d, pub_name),  "r", encoding="utf-8") as f: pub_pem  = f.read()
+    return priv_pem, pub_pem
+
 def load_keys_from_env() -> Tuple[Ed25519PrivateKey, bytes]:
     # 1) Secret Files trên Render (ưu tiên)
-    secret_candidates = [
-        ("/etc/secrets/license_private_key.pem", "/etc/secrets/license_public_key.pem"),
-        ("/etc/secrets/private.pem",            "/etc/secrets/public.pem"),
-    ]
-    for priv_path, pub_path in secret_candidates:
-        if os.path.exists(priv_path) and os.path.exists(pub_path):
-            with open(priv_path, "r", encoding="utf-8") as f: priv_pem = f.read()
-            with open(pub_path,  "r", encoding="utf-8") as f: pub_pem  = f.read()
+    secrets = _list_dir("/etc/secrets")
+    for priv_name, pub_name in (("license_private_key.pem", "license_public_key.pem"),
+                                ("private.pem",             "public.pem")):
+        if priv_name in secrets and pub_name in secrets:
+            priv_pem, pub_pem = _read_pair("/etc/secrets", priv_name, pub_name)
             return _load_pems(_normalize_pem(priv_pem), _normalize_pem(pub_pem))
 
     # 2) ENV trực tiếp (PEM đa dòng)
@@ -58,16 +82,12 @@ def load_keys_from_env() -> Tuple[Ed25519PrivateKey, bytes]:
         return _load_pems(_normalize_pem(priv_pem), _normalize_pem(pub_pem))
 
     # 5) Thư mục Key cục bộ trong repo (fallback local dev)
-    local_candidates = [
-        (os.path.join(BASE_DIR, "Key",  "license_private_key.pem"),
-         os.path.join(BASE_DIR, "Key",  "license_public_key.pem")),
-        (os.path.join(BASE_DIR, "keys", "private.pem"),
-         os.path.join(BASE_DIR, "keys", "public.pem")),
-    ]
-    for priv_path, pub_path in local_candidates:
-        if os.path.exists(priv_path) and os.path.exists(pub_path):
-            with open(priv_path, "r", encoding="utf-8") as f: priv_pem = f.read()
-            with open(pub_path,  "r", encoding="utf-8") as f: pub_pem  = f.read()
+    for sub, priv_name, pub_name in (("Key",  "license_private_key.pem", "license_public_key.pem"),
+                                     ("keys", "private.pem",             "public.pem")):
+        d = os.path.join(BASE_DIR, sub)
+        files = _list_dir(d)
+        if priv_name in files and pub_name in files:
+            priv_pem, pub_pem = _read_pair(d, priv_name, pub_name)
             return _load_pems(_normalize_pem(priv_pem), _normalize_pem(pub_pem))
 
     raise RuntimeError(
@@ -78,25 +98,64 @@ def load_keys_from_env() -> Tuple[Ed25519PrivateKey, bytes]:
     )
 
 # ===== signing / verifying =====
+# SPKI DER của Ed25519 = 12 byte header cố định + 32 byte raw key
+_ED25519_SPKI_PREFIX = bytes.fromhex("302a300506032b6570032100")
+
+@lru_cache(maxsize=4)
 def kid_from_pub(pub_pem: bytes, length=24) -> str:
-    pub = serialization.load_pem_public_key(pub_pem)
-    spki = pub.public_bytes(encoding=serialization.Encoding.DER,
-                            format=serialization.PublicFormat.SubjectPublicKeyInfo)
-    h = hashlib.sha256(spki).digest()
+    # public key cố định suốt vòng đời process -> tính 1 lần (sha256 + base32)
+    # dùng key đã parse sẵn của load_public_key, ghép SPKI từ raw key thay vì serialize DER lại
+    pub = load_public_key(pub_pem)
+    if _NaclVerifyKey is not None and isinstance(pub, _NaclVerifyKey):
+        raw = bytes(pub)
+    else:
+        raw = pub.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    h = hashlib.sha256(_ED25519_SPKI_PREFIX + raw).digest()
     b32 = base64.b32encode(h).decode().rstrip("=")
     return "-".join(textwrap.wrap(b32[:length], 4))
 
-def sign_token(priv: Ed25519PrivateKey, payload: Dict[str, Any]) -> str:
-    body = msgpack.packb(payload, use_bin_type=True)
-    sig  = priv.sign(body)
+def load_signing_key(priv: Ed25519PrivateKey):
+    """Đổi private key sang SigningKey của PyNaCl (nếu có) 1 lần lúc startup; không có thì giữ nguyên."""
+    if _NaclSigningKey is None:
+        return priv
+    raw = priv.private_bytes(serialization.Encoding.Raw, serialization.PrivateFormat.Raw,
+                             serialization.NoEncryption())
+    return _NaclSigningKey(raw)
+
+# Packer dùng lại (packb tạo Packer mới mỗi lần); autoreset -> pack() trả bytes và tự xoá buffer.
+# Không thread-safe: sign_token chỉ được gọi trên event loop của app.
+_PACKER = msgpack.Packer(use_bin_type=True)
+
+def sign_token(priv, payload: Dict[str, Any]) -> str:
+    body = _PACKER.pack(payload)
+    if _NaclSigningKey is not None and isinstance(priv, _NaclSigningKey):
+        sig = priv.sign(body).signature
+    else:
+        sig = priv.sign(body)
     return f"{b64u(body)}.{b64u(sig)}"
 
-def verify_token(pub_pem: bytes, token: str) -> Dict[str, Any]:
+@lru_cache(maxsize=8)
+def load_public_key(pub_pem: bytes):
+    """Parse PEM 1 lần (lúc startup) để verify_token không phải parse lại mỗi request.
+    Trả VerifyKey của PyNaCl nếu có, ngược lại Ed25519PublicKey.
+    Cache theo PEM: verify_token(pub_pem_bytes, ...) cũng chỉ parse lần đầu."""
+    pub = serialization.load_pem_public_key(pub_pem)
+    if _NaclVerifyKey is None:
+        return pub
+    return _NaclVerifyKey(pub.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw))
+
+def verify_token(pub, token: str) -> Dict[str, Any]:
     body_b64, sig_b64 = token.split(".", 1)
     body = b64u_d(body_b64); sig = b64u_d(sig_b64)
-    pub = serialization.load_pem_public_key(pub_pem)
-    pub.verify(sig, body)
+    if isinstance(pub, bytes):
+        pub = load_public_key(pub)
+    if _NaclVerifyKey is not None and isinstance(pub, _NaclVerifyKey):
+        pub.verify(body, sig)  # sai chữ ký -> nacl.exceptions.BadSignatureError
+    else:
+        pub.verify(sig, body)
     data = msgpack.unpackb(body, raw=False)
-    if "e" in data and int(data["e"]) < int(time.time()):
+    # "e" do chính server ký (int epoch) -> so thẳng, khỏi ép kiểu
+    exp = data.get("e")
+    if exp is not None and exp < time.time():
         raise ValueError("expired")
     return data
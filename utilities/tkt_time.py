@@ -1,4 +1,17 @@
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+try:
+    from zoneinfo import ZoneInfo
+except Exception:
+    ZoneInfo = None
+
+# Giờ địa phương của hệ thống (Asia/Bangkok, +07:00, không DST)
+if ZoneInfo:
+    try:
+        LOCAL_TZ = ZoneInfo("Asia/Bangkok")
+    except Exception:
+        LOCAL_TZ = timezone(timedelta(hours=7))
+else:
+    LOCAL_TZ = timezone(timedelta(hours=7))
 
 # Định dạng dùng cho tên file/thư mục
 TIME_FMT_FILE = "%Y-%m-%d_%H%M"
@@ -26,3 +39,7 @@ def to_iso_z(dt: datetime | None = None) -> str:
     if dt is None:
         dt = utc_now()
     return dt.astimezone(timezone.utc).replace(microsecond=0).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def now_local_naive() -> datetime:
+    """Giờ Asia/Bangkok nhưng NAIVE (không tzinfo) để lưu DB & so sánh."""
+    return datetime.now(LOCAL_TZ).replace(tzinfo=None)